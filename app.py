@@ -1,78 +1,266 @@
 import os
-import io
-import matplotlib.pyplot as plt
-import numpy as np
-import uuid  # Import the uuid module
-from flask import Flask, request, Response, jsonify
+from flask import Flask, request, Response, jsonify, send_from_directory, g
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import safe_join
+
+from batch import error_entry, stream_zip
+from chart_storage import ChartStorage, INDEX_NAME
+from chart_writer import ChartWriter
+from render_cache import RenderCache, cache_key
+from render_pool import RenderPool, RenderError
+from single_flight import SingleFlight
+from validation import (ANIMATED_TYPES, CHART_TYPES, ValidationError, chart_payload,
+                        check_size, parse_request, read_json)
+import encoding
+import inline
+import metrics
+import readiness
+import svg_render
 
 app = Flask(__name__)
 
+# Largest request body accepted; bigger requests get 413
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
 # Directory to store generated chart images
 CHARTS_DIR = 'charts'
 
 # Ensure the charts directory exists
 os.makedirs(CHARTS_DIR, exist_ok=True)
 
+# Sharded chart files with TTL and size-quota eviction
+chart_storage = ChartStorage(CHARTS_DIR)
+
+# Chart files are written in the background so *url requests return at once
+chart_writer = ChartWriter()
+
+# Identical charts requested at the same time are rendered once
+render_flights = SingleFlight()
+
+# Rendered charts keyed by a hash of the normalized request and format
+render_cache = RenderCache(chart_storage, writer=chart_writer, flights=render_flights)
+
+# Matplotlib runs in worker processes; handlers only validate and hand off
+render_pool = RenderPool()
+
 api_port = int(os.environ.get('API_PORT', 80))
 
+metrics.registry.register(metrics.Gauge(
+    'chart_render_jobs', 'Renders queued or running in the render pool',
+    callback=lambda: render_pool.jobs))
+metrics.registry.register(metrics.Gauge(
+    'chart_render_queued', 'Renders waiting for a free render worker',
+    callback=lambda: max(render_pool.jobs - max(render_pool.workers, 1), 0)))
+metrics.registry.register(metrics.Gauge(
+    'chart_renders_in_flight', 'Distinct charts being rendered',
+    callback=render_flights.in_flight))
+metrics.registry.register(metrics.Gauge(
+    'chart_process_rss_bytes', 'Resident memory per web process', ['pid'],
+    callback=lambda: {(os.getpid(),): metrics.rss_bytes()}))
+metrics.registry.register(metrics.Gauge(
+    'chart_write_backlog', 'Chart files waiting to be written to disk',
+    callback=chart_writer.backlog))
+metrics.registry.register(metrics.Gauge(
+    'chart_storage_bytes', 'Bytes of chart files on disk',
+    callback=lambda: chart_storage.stats()['bytes'], multiprocess='max'))
+metrics.registry.register(metrics.Gauge(
+    'chart_storage_evictions', 'Chart files deleted by the storage reaper', ['reason'],
+    callback=lambda: {(reason,): count
+                      for reason, count in chart_storage.evictions.items()}))
+
+# Seconds a client asking to wait for a chart file is held before 'pending'
+CHART_WAIT_TIMEOUT = float(os.environ.get('CHART_WAIT_TIMEOUT', 10))
+
+# Maximum number of charts accepted by /charts/batch
+BATCH_MAX_CHARTS = int(os.environ.get('BATCH_MAX_CHARTS', 1000))
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics = metrics.begin_request()
+
+
+@app.before_request
+def check_request_size():
+    # Reject oversized bodies before the handlers read them
+    limit = app.config['MAX_CONTENT_LENGTH']
+    if limit and request.content_length is not None and request.content_length > limit:
+        raise RequestEntityTooLarge()
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"error": "Request body too large"}), 413
+
+
+@app.after_request
+def record_request_metrics(response):
+    state = g.pop('metrics', None)
+    if state is None:
+        return response
+
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    # Streamed bodies only count when they declared their length
+    size = response.content_length
+    timings = metrics.end_request(state, endpoint, response.status_code, size)
+    if metrics.SERVER_TIMING and timings:
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
+
+
+def render_chart(kind, payload, fmt='png', options=None):
+    # Wheel and Ikigai SVGs are written directly, with text outlines cached
+    # across requests, without going through matplotlib
+    if not options:
+        img_data = svg_render.render(kind, payload, fmt)
+        if img_data is not None:
+            return img_data
+    return render_pool.render(kind, payload, fmt, options)
+
+
+def render_cached(kind, payload, fmt='png', options=None):
+    key = cache_key(kind, payload, fmt, options)
+    return render_cache.get_or_render(
+        key, fmt, lambda: render_chart(kind, payload, fmt, options))
+
+
+def chart_url(kind, payload, fmt='png', options=None, wait=False):
+    key = cache_key(kind, payload, fmt, options)
+    # The file on disk is content-addressed, so a repeat request reuses it
+    render_cache.save(key, fmt, lambda: render_chart(kind, payload, fmt, options))
+
+    # The file is written in the background unless the client asked to wait
+    if wait:
+        chart_writer.wait(render_cache.path(key, fmt), CHART_WAIT_TIMEOUT)
+    status = 'ready' if render_cache.ready(key, fmt) else 'pending'
+    return {"chart_url": f"/{CHARTS_DIR}/{render_cache.relpath(key, fmt)}",
+            "status": status}
+
+
+def render_batch(items, fmt='png'):
+    # Yield (key, data, error) for each (kind, payload) in order. Cache hits
+    # are read back directly, misses are rendered in parallel by the pool.
+    keys = [cache_key(kind, payload, fmt) for kind, payload in items]
+    # Render each distinct chart once; repeats are served from the cache
+    missing = {}
+    for i, key in enumerate(keys):
+        if key not in missing and not render_cache.exists(key, fmt):
+            missing[key] = i
+    rendered = render_pool.map([(*items[i], fmt, None) for i in missing.values()])
+
+    for i, ((kind, payload), key) in enumerate(zip(items, keys)):
+        if missing.get(key) == i:
+            data, error = next(rendered)
+            if error is None:
+                render_cache.put(key, fmt, data)
+        else:
+            try:
+                data, error = render_cached(kind, payload, fmt), None
+            except Exception as e:
+                data, error = None, e
+        yield key, data, error
+
+
+def batch_zip_entries(items):
+    errors = []
+    for i, ((kind, _), (_, data, error)) in enumerate(zip(items, render_batch(items))):
+        if error is not None:
+            errors.append({"index": i, "error": str(error)})
+            continue
+        yield f"{i:04d}_{kind}.png", data
+
+    if errors:
+        yield error_entry(errors)
+
+
+def render_error(e):
+    response = jsonify({"error": str(e)})
+    response.status_code = e.status
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+def inline_response(img_data, fmt):
+    # The image in the representation the client asked for: raw bytes, a JSON
+    # data URI or base64 text. Base64 is streamed from the render buffer
+    # rather than built as one string.
+    content_type = encoding.CONTENT_TYPES[fmt]
+    mode = inline.negotiate(request.accept_mimetypes, content_type)
+    if mode == 'binary':
+        body, mimetype = [img_data], content_type
+        length = len(img_data)
+    else:
+        length = 4 * ((len(img_data) + 2) // 3)
+        if mode == 'json':
+            body, mimetype = inline.data_uri_chunks(img_data, content_type), inline.JSON
+            length += len(inline.data_uri_prefix(content_type)) + len(inline.DATA_URI_SUFFIX)
+        else:
+            body, mimetype = inline.base64_chunks(img_data), inline.TEXT
+
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    if 'gzip' in request.accept_encodings and inline.worth_gzipping(mode, content_type, length):
+        body = inline.gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        headers['Content-Length'] = str(length)
+    return Response(body, mimetype=mimetype, headers=headers)
+
 
 @app.route('/chart', methods=['POST'])
 def generate_chart():
     try:
-        # Get data from the request JSON
-        data = request.json
+        # Parse and validate the request JSON before anything is rendered
+        with metrics.stage('parse'):
+            data, payload, fmt, options = parse_request(request, 'wheel', MAX_REQUEST_BYTES)
 
-        # Ensure that the request contains 'labels', 'sizes', and 'colors' keys
-        if 'data' not in data or 'categories' not in data or 'title' not in data:
-            return jsonify({"error": "Invalid data format"}), 400
-
-        data_points = data['data']
-        areas = data['categories']
-        title = data['title']
-
-        N = len(areas)
-        theta = np.linspace(0.0, 2 * np.pi, N, endpoint=False)
-        radii = data_points
-        width = np.pi / 4 * np.ones(N)
-
-        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw={
-                               'projection': 'polar'})
-        bars = ax.bar(theta, radii, width=width, bottom=0.0,
-                      align='center', edgecolor='gray', linewidth=0.5)
-
-        # A clearer color palette - can be customized
-        colors = ["#FF9999", "#66B2FF", "#99FF99", "#FFCC99",
-                  "#FFD700", "#C71585", "#20B2AA", "#FF4500"]
-        for bar, color in zip(bars, colors):
-            bar.set_facecolor(color)
-            bar.set_alpha(0.7)
-
-        # Remove gridlines and outer circle (spine)
-        ax.yaxis.grid(False)
-        ax.xaxis.grid(False)
-        ax.spines["polar"].set_visible(False)
-
-        # Remove ytick labels and set xtick labels with padding and custom font properties
-        ax.set_yticklabels([])
-        ax.set_xticks(theta)
-        ax.set_xticklabels(areas, fontdict={
-                           'fontsize': 10, 'fontweight': 'bold', 'color': '#555555'})
-
-        # Set title with custom font properties
-        ax.set_title(title, va='bottom', fontdict={
-                     'fontsize': 14, 'fontweight': 'bold'})
-
-        # Add padding to the image
-        plt.tight_layout()
-
-        # Save the chart as bytes in memory
-        img_data = io.BytesIO()
-        plt.savefig(img_data, format='png')
-        img_data.seek(0)
-        plt.close()
+        img_data = render_cached('wheel', payload, fmt, options)
 
         # Return the image binary data as a Flask response
-        return Response(img_data.getvalue(), content_type='image/png')
+        return Response(img_data, content_type=encoding.CONTENT_TYPES[fmt])
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RenderError as e:
+        return render_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/chartmulti', methods=['POST'])
+def generate_chart_multi():
+    try:
+        # Parse and validate the request JSON before anything is rendered
+        with metrics.stage('parse'):
+            data, payload, fmt, options = parse_request(request, 'multi', MAX_REQUEST_BYTES)
+
+        img_data = render_cached('multi', payload, fmt, options)
+
+        # One figure with every entity's wheel
+        return Response(img_data, content_type=encoding.CONTENT_TYPES[fmt])
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RenderError as e:
+        return render_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/charttimeline', methods=['POST'])
+def generate_chart_timeline():
+    try:
+        # Parse and validate the request JSON before anything is rendered
+        with metrics.stage('parse'):
+            data, payload, fmt, options = parse_request(request, 'timeline', MAX_REQUEST_BYTES)
+
+        img_data = render_cached('timeline', payload, fmt, options)
+
+        # Every snapshot of the wheel in one animation or sprite sheet
+        return Response(img_data, content_type=encoding.CONTENT_TYPES[fmt])
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RenderError as e:
+        return render_error(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -80,67 +268,18 @@ def generate_chart():
 @app.route('/ikigai', methods=['POST'])
 def draw_ikigai():
     try:
-        # Get data from the request JSON
-        data = request.json
-
-        # Ensure that the request contains 'labels', 'sizes', and 'colors' keys
-        if 'labels' not in data or 'overlap' not in data or 'title' not in data:
-            return jsonify({"error": "Invalid data format"}), 400
+        # Parse and validate the request JSON before anything is rendered
+        with metrics.stage('parse'):
+            data, payload, fmt, options = parse_request(request, 'ikigai', MAX_REQUEST_BYTES)
 
-        labels = data['labels']
-        overlap_labels = data['overlap']
-        title = data['title']
-
-        fig, ax = plt.subplots(figsize=(10, 10))
-
-        # Define circle radius and centers for a diagonal orientation
-        r = 1.25
-        offset = 0.6  # Adjusted for central intersection
-        centers = [(0, offset), (-offset, 0), (0, -offset), (offset, 0)]
-
-        # Colors for the circles
-        colors = ['#FF9999', '#66B2FF', '#99FF99', '#FFCC99']
-
-        # Create circles
-        circles = [plt.Circle(center, r, color=color, alpha=0.4)
-                   for center, color in zip(centers, colors)]
-        for circle in circles:
-            ax.add_patch(circle)
-
-        # Adjusted positions for each circle's label to the outer edge
-        label_positions = [(0, offset + r - 0.1), (-offset - r + 0.1, 0),
-                           (0, -offset - r + 0.1), (offset + r - 0.1, 0)]
-        for position, label in zip(label_positions, labels):
-            ax.text(position[0], position[1], label, ha='center',
-                    va='center', fontsize=9, fontweight='bold')
-
-        # Set text for the overlaps
-        overlap_positions = [
-            (-offset, offset), (-offset, -offset), (offset, -offset), (offset, offset)]
-        for position, label in zip(overlap_positions, overlap_labels):
-            ax.text(position[0], position[1], label, ha='center', va='center',
-                    fontsize=9, fontweight='bold', backgroundcolor='white', zorder=5)
-
-        # Highlight central IKIGAI text
-        ax.text(0, 0, title, ha='center', va='center', fontsize=20,
-                fontweight='bold', color='#555555', zorder=5, backgroundcolor='white')
-
-        ax.set_xlim(-2.5, 2.5)
-        ax.set_ylim(-2.5, 2.5)
-        ax.set_aspect('equal', 'box')
-        ax.axis('off')
-
-        # Add padding to the image
-        plt.tight_layout()
-
-        # Save the chart as bytes in memory
-        img_data = io.BytesIO()
-        plt.savefig(img_data, format='png')
-        img_data.seek(0)
-        plt.close()
+        img_data = render_cached('ikigai', payload, fmt, options)
 
         # Return the image binary data as a Flask response
-        return Response(img_data.getvalue(), content_type='image/png')
+        return Response(img_data, content_type=encoding.CONTENT_TYPES[fmt])
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RenderError as e:
+        return render_error(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -148,63 +287,17 @@ def draw_ikigai():
 @app.route('/chartb', methods=['POST'])
 def generate_chartb():
     try:
-        # Get data from the request JSON
-        data = request.json
+        # Parse and validate the request JSON before anything is rendered
+        with metrics.stage('parse'):
+            data, payload, fmt, options = parse_request(request, 'wheel', MAX_REQUEST_BYTES)
 
-        # Ensure that the request contains 'labels', 'sizes', and 'colors' keys
-        if 'data' not in data or 'categories' not in data or 'title' not in data:
-            return jsonify({"error": "Invalid data format"}), 400
+        img_data = render_cached('wheel', payload, fmt, options)
 
-        data_points = data['data']
-        areas = data['categories']
-        title = data['title']
-
-        N = len(areas)
-        theta = np.linspace(0.0, 2 * np.pi, N, endpoint=False)
-        radii = data_points
-        width = np.pi / 4 * np.ones(N)
-
-        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw={
-                               'projection': 'polar'})
-        bars = ax.bar(theta, radii, width=width, bottom=0.0,
-                      align='center', edgecolor='gray', linewidth=0.5)
-
-        # A clearer color palette - can be customized
-        colors = ["#FF9999", "#66B2FF", "#99FF99", "#FFCC99",
-                  "#FFD700", "#C71585", "#20B2AA", "#FF4500"]
-        for bar, color in zip(bars, colors):
-            bar.set_facecolor(color)
-            bar.set_alpha(0.7)
-
-        # Remove gridlines and outer circle (spine)
-        ax.yaxis.grid(False)
-        ax.xaxis.grid(False)
-        ax.spines["polar"].set_visible(False)
-
-        # Remove ytick labels and set xtick labels with padding and custom font properties
-        ax.set_yticklabels([])
-        ax.set_xticks(theta)
-        ax.set_xticklabels(areas, fontdict={
-                           'fontsize': 10, 'fontweight': 'bold', 'color': '#555555'})
-
-        # Set title with custom font properties
-        ax.set_title(title, va='bottom', fontdict={
-                     'fontsize': 14, 'fontweight': 'bold'})
-
-        # Add padding to the image
-        plt.tight_layout()
-
-        # Save the chart as bytes in memory
-        img_data = io.BytesIO()
-        plt.savefig(img_data, format='png')
-        img_data.seek(0)
-        plt.close()
-
-       # Encode the image data as base64 and return it as a string
-        base64_img = base64.b64encode(img_data.read()).decode('utf-8')
-
-        # Return the base64-encoded image as a string in the response
-        return base64_img
+        return inline_response(img_data, fmt)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RenderError as e:
+        return render_error(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -212,70 +305,17 @@ def generate_chartb():
 @app.route('/ikigaib', methods=['POST'])
 def draw_ikigaib():
     try:
-        # Get data from the request JSON
-        data = request.json
+        # Parse and validate the request JSON before anything is rendered
+        with metrics.stage('parse'):
+            data, payload, fmt, options = parse_request(request, 'ikigai', MAX_REQUEST_BYTES)
 
-        # Ensure that the request contains 'labels', 'sizes', and 'colors' keys
-        if 'labels' not in data or 'overlap' not in data or 'title' not in data:
-            return jsonify({"error": "Invalid data format"}), 400
+        img_data = render_cached('ikigai', payload, fmt, options)
 
-        labels = data['labels']
-        overlap_labels = data['overlap']
-        title = data['title']
-
-        fig, ax = plt.subplots(figsize=(10, 10))
-
-        # Define circle radius and centers for a diagonal orientation
-        r = 1.25
-        offset = 0.6  # Adjusted for central intersection
-        centers = [(0, offset), (-offset, 0), (0, -offset), (offset, 0)]
-
-        # Colors for the circles
-        colors = ['#FF9999', '#66B2FF', '#99FF99', '#FFCC99']
-
-        # Create circles
-        circles = [plt.Circle(center, r, color=color, alpha=0.4)
-                   for center, color in zip(centers, colors)]
-        for circle in circles:
-            ax.add_patch(circle)
-
-        # Adjusted positions for each circle's label to the outer edge
-        label_positions = [(0, offset + r - 0.1), (-offset - r + 0.1, 0),
-                           (0, -offset - r + 0.1), (offset + r - 0.1, 0)]
-        for position, label in zip(label_positions, labels):
-            ax.text(position[0], position[1], label, ha='center',
-                    va='center', fontsize=9, fontweight='bold')
-
-        # Set text for the overlaps
-        overlap_positions = [
-            (-offset, offset), (-offset, -offset), (offset, -offset), (offset, offset)]
-        for position, label in zip(overlap_positions, overlap_labels):
-            ax.text(position[0], position[1], label, ha='center', va='center',
-                    fontsize=9, fontweight='bold', backgroundcolor='white', zorder=5)
-
-        # Highlight central IKIGAI text
-        ax.text(0, 0, title, ha='center', va='center', fontsize=20,
-                fontweight='bold', color='#555555', zorder=5, backgroundcolor='white')
-
-        ax.set_xlim(-2.5, 2.5)
-        ax.set_ylim(-2.5, 2.5)
-        ax.set_aspect('equal', 'box')
-        ax.axis('off')
-
-        # Add padding to the image
-        plt.tight_layout()
-
-        # Save the chart as bytes in memory
-        img_data = io.BytesIO()
-        plt.savefig(img_data, format='png')
-        img_data.seek(0)
-        plt.close()
-
-       # Encode the image data as base64 and return it as a string
-        base64_img = base64.b64encode(img_data.read()).decode('utf-8')
-
-        # Return the base64-encoded image as a string in the response
-        return base64_img
+        return inline_response(img_data, fmt)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RenderError as e:
+        return render_error(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -283,134 +323,138 @@ def draw_ikigaib():
 @app.route('/charturl', methods=['POST'])
 def generate_chart_url():
     try:
-        # Get data from the request JSON
-        data = request.json
-
-        # Ensure that the request contains 'data', 'categories', and 'title' keys
-        if 'data' not in data or 'categories' not in data or 'title' not in data:
-            return jsonify({"error": "Invalid data format"}), 400
-
-        data_points = data['data']
-        areas = data['categories']
-        title = data['title']
-
-        N = len(areas)
-        theta = np.linspace(0.0, 2 * np.pi, N, endpoint=False)
-        radii = data_points
-        width = np.pi / 4 * np.ones(N)
-
-        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw={
-                               'projection': 'polar'})
-        bars = ax.bar(theta, radii, width=width, bottom=0.0,
-                      align='center', edgecolor='gray', linewidth=0.5)
-
-        colors = ["#FF9999", "#66B2FF", "#99FF99", "#FFCC99",
-                  "#FFD700", "#C71585", "#20B2AA", "#FF4500"]
-        for bar, color in zip(bars, colors):
-            bar.set_facecolor(color)
-            bar.set_alpha(0.7)
-
-        ax.yaxis.grid(False)
-        ax.xaxis.grid(False)
-        ax.spines["polar"].set_visible(False)
-        ax.set_yticklabels([])
-        ax.set_xticks(theta)
-        ax.set_xticklabels(areas, fontdict={
-                           'fontsize': 10, 'fontweight': 'bold', 'color': '#555555'})
-        ax.set_title(title, va='bottom', fontdict={
-                     'fontsize': 14, 'fontweight': 'bold'})
-
-        plt.tight_layout()
-
-        # Generate a random GUID for the image name
-        chart_filename = f"{uuid.uuid4()}.png"
-        chart_path = os.path.join(CHARTS_DIR, chart_filename)
-
-        # Save the chart as a PNG image
-        plt.savefig(chart_path, format='png')
-        plt.close()
-
-        # Construct the URL for the saved chart image
-        chart_url = f"/{CHARTS_DIR}/{chart_filename}"
+        # Parse and validate the request JSON before anything is rendered
+        with metrics.stage('parse'):
+            data, payload, fmt, options = parse_request(request, 'wheel', MAX_REQUEST_BYTES)
 
         # Return the URL in the response
-        return jsonify({"chart_url": chart_url})
+        return jsonify(chart_url('wheel', payload, fmt, options,
+                                 wait=bool(data.get('wait'))))
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RenderError as e:
+        return render_error(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/ikigaiurl', methods=['POST'])
 def draw_ikigai_url():
+    try:
+        # Parse and validate the request JSON before anything is rendered
+        with metrics.stage('parse'):
+            data, payload, fmt, options = parse_request(request, 'ikigai', MAX_REQUEST_BYTES)
+
+        # Return the URL in the response
+        return jsonify(chart_url('ikigai', payload, fmt, options,
+                                 wait=bool(data.get('wait'))))
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except RenderError as e:
+        return render_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/charts/batch', methods=['POST'])
+def render_charts_batch():
     try:
         # Get data from the request JSON
-        data = request.json
+        with metrics.stage('parse'):
+            data = read_json(request, MAX_REQUEST_BYTES)
 
-        # Ensure that the request contains 'labels', 'sizes', and 'colors' keys
-        if 'labels' not in data or 'overlap' not in data or 'title' not in data:
+        # Ensure that the request contains a 'charts' list of chart specs
+        if 'charts' not in data or not isinstance(data['charts'], list):
             return jsonify({"error": "Invalid data format"}), 400
+        if len(data['charts']) > BATCH_MAX_CHARTS:
+            return jsonify({"error": f"A batch can contain at most {BATCH_MAX_CHARTS} charts"}), 413
+
+        output = data.get('output', 'zip')
+        if output not in ('zip', 'urls'):
+            return jsonify({"error": "'output' must be 'zip' or 'urls'"}), 400
+
+        # Every chart is validated before the first one renders
+        items = []
+        for index, chart in enumerate(data['charts']):
+            kind = chart.get('type') if isinstance(chart, dict) else None
+            if kind not in CHART_TYPES or kind in ANIMATED_TYPES:
+                return jsonify({"error": f"Invalid data format for chart {index}"}), 400
+            try:
+                payload = chart_payload(kind, chart)
+                check_size(kind, payload)
+                items.append((kind, payload))
+            except ValidationError as e:
+                return jsonify({"error": f"Invalid chart {index}: {e}"}), 400
+
+        if output == 'urls':
+            charts = []
+            for key, _, error in render_batch(items):
+                if error is not None:
+                    charts.append({"error": str(error)})
+                else:
+                    charts.append(
+                        {"chart_url": f"/{CHARTS_DIR}/{render_cache.relpath(key)}"})
+            return jsonify({"charts": charts})
+
+        # Stream the archive while the remaining charts render
+        return Response(stream_zip(batch_zip_entries(items)),
+                        content_type='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename=charts.zip'})
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        labels = data['labels']
-        overlap_labels = data['overlap']
-        title = data['title']
-
-        fig, ax = plt.subplots(figsize=(10, 10))
 
-        # Define circle radius and centers for a diagonal orientation
-        r = 1.25
-        offset = 0.6  # Adjusted for central intersection
-        centers = [(0, offset), (-offset, 0), (0, -offset), (offset, 0)]
+@app.route(f'/{CHARTS_DIR}/<path:filename>', methods=['GET'])
+def get_chart(filename):
+    # Charts from the *url and batch endpoints may still be on their way to
+    # disk, possibly written by another web worker. Answer 202 while the write
+    # is queued, or hold the request with ?wait=1; unknown files are 404s.
+    if os.path.basename(filename).startswith(INDEX_NAME):
+        return jsonify({"error": "Not found"}), 404
 
-        # Colors for the circles
-        colors = ['#FF9999', '#66B2FF', '#99FF99', '#FFCC99']
+    path = safe_join(CHARTS_DIR, filename)
+    if path is not None and not os.path.exists(path) and chart_writer.in_flight(path):
+        wait = request.args.get('wait', '0') not in ('0', 'false', '')
+        if not wait or not chart_writer.wait(path, CHART_WAIT_TIMEOUT):
+            response = jsonify({"status": "pending"})
+            response.status_code = 202
+            response.headers['Retry-After'] = '1'
+            return response
 
-        # Create circles
-        circles = [plt.Circle(center, r, color=color, alpha=0.4)
-                   for center, color in zip(centers, colors)]
-        for circle in circles:
-            ax.add_patch(circle)
+    chart_storage.touch(filename)
+    return send_from_directory(os.path.abspath(CHARTS_DIR), filename)
 
-        # Adjusted positions for each circle's label to the outer edge
-        label_positions = [(0, offset + r - 0.1), (-offset - r + 0.1, 0),
-                           (0, -offset - r + 0.1), (offset + r - 0.1, 0)]
-        for position, label in zip(label_positions, labels):
-            ax.text(position[0], position[1], label, ha='center',
-                    va='center', fontsize=9, fontweight='bold')
 
-        # Set text for the overlaps
-        overlap_positions = [
-            (-offset, offset), (-offset, -offset), (offset, -offset), (offset, offset)]
-        for position, label in zip(overlap_positions, overlap_labels):
-            ax.text(position[0], position[1], label, ha='center', va='center',
-                    fontsize=9, fontweight='bold', backgroundcolor='white', zorder=5)
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.expose(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        # Highlight central IKIGAI text
-        ax.text(0, 0, title, ha='center', va='center', fontsize=20,
-                fontweight='bold', color='#555555', zorder=5, backgroundcolor='white')
 
-        ax.set_xlim(-2.5, 2.5)
-        ax.set_ylim(-2.5, 2.5)
-        ax.set_aspect('equal', 'box')
-        ax.axis('off')
+@app.route('/storage/stats', methods=['GET'])
+def storage_stats():
+    # Bytes stored and eviction counts of the chart storage
+    return jsonify(chart_storage.stats())
 
-        # Add padding to the image
-        plt.tight_layout()
 
-         # Generate a random GUID for the image name
-        chart_filename = f"{uuid.uuid4()}.png"
-        chart_path = os.path.join(CHARTS_DIR, chart_filename)
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the server answers requests
+    return jsonify({"status": "ok"})
 
-        # Save the chart as a PNG image
-        plt.savefig(chart_path, format='png')
-        plt.close()
 
-        # Construct the URL for the saved chart image
-        chart_url = f"/{CHARTS_DIR}/{chart_filename}"
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: route traffic here only once the render workers of every web
+    # worker have warmed up
+    if not render_pool.warmed.is_set() or not readiness.all_warm():
+        return jsonify({"status": "warming"}), 503
+    return jsonify({"status": "ready"})
 
-        # Return the URL in the response
-        return jsonify({"chart_url": chart_url})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=api_port, debug=False,  threaded=False)
+    chart_storage.start()
+    render_pool.start()
+    app.run(host='0.0.0.0', port=api_port, debug=False, threaded=True)
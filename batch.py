@@ -0,0 +1,38 @@
+import io
+import json
+import zipfile
+
+
+class _ZipStream(io.RawIOBase):
+    # Write-only sink that hands back whatever zipfile wrote since the last drain
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    # Yield a ZIP archive chunk by chunk from (name, data) pairs, so the first
+    # charts reach the client while later ones are still rendering.
+    # PNGs are already compressed, so entries are stored as-is.
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+            yield stream.drain()
+    yield stream.drain()
+
+
+def error_entry(errors):
+    # Failed items are listed in the archive instead of aborting the stream
+    return 'errors.json', json.dumps(errors, indent=2).encode('utf-8')
@@ -0,0 +1,244 @@
+import argparse
+import json
+import math
+import platform
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Render and HTTP benchmarks for the chart endpoints. Results are written as
+# JSON so two runs can be compared, e.g. in CI:
+#
+#   python benchmark.py render --output base.json
+#   python benchmark.py load --concurrency 8 --output load.json
+#   python benchmark.py compare base.json new.json --threshold 0.1
+
+ENDPOINTS = ['/chart', '/chartb', '/charturl', '/ikigai', '/ikigaib', '/ikigaiurl']
+
+CATEGORIES = ["Health", "Relationships", "Career", "Finance", "Learning",
+              "Leisure", "Physical Environment", "Personal Growth"]
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of an unsorted list
+    ordered = sorted(values)
+    rank = max(int(math.ceil(p / 100.0 * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(name, timings, **extra):
+    timings_ms = [t * 1000 for t in timings]
+    result = {
+        'name': name,
+        'count': len(timings_ms),
+        'min_ms': min(timings_ms),
+        'mean_ms': sum(timings_ms) / len(timings_ms),
+        'p50_ms': percentile(timings_ms, 50),
+        'p95_ms': percentile(timings_ms, 95),
+        'p99_ms': percentile(timings_ms, 99),
+    }
+    result.update(extra)
+    return result
+
+
+def wheel_payload(n, i=0):
+    categories = [CATEGORIES[j % len(CATEGORIES)] + ('' if j < len(CATEGORIES) else f" {j}")
+                  for j in range(n)]
+    return {'data': [(i + j) % 10 + 1 for j in range(n)], 'categories': categories,
+            'title': f"Wheel of Life {i}"}
+
+
+def ikigai_payload(i=0):
+    return {'labels': ['Love', 'World Needs', 'Good At', 'Paid For'],
+            'overlap': ['Passion', 'Mission', 'Profession', 'Vocation'],
+            'title': f"IKIGAI {i}"}
+
+
+def payload_for(endpoint, n, i):
+    return ikigai_payload(i) if endpoint.startswith('/ikigai') else wheel_payload(n, i)
+
+
+def run_render(args):
+    import chart_render
+
+    results = []
+    cases = [('wheel', n) for n in args.categories] + [('ikigai', None)]
+    for kind, n in cases:
+        for dpi in args.dpi:
+            for fmt in args.formats:
+                name = f"render/{kind}" + (f"/n={n}" if n else '') + f"/dpi={dpi}/{fmt}"
+                timings = []
+                size = 0
+                # The first render builds the template; report it separately
+                for i in range(args.repeat + 1):
+                    start = time.perf_counter()
+                    if kind == 'wheel':
+                        p = wheel_payload(n, i)
+                        img_data = chart_render.render_wheel(
+                            p['data'], p['categories'], p['title'], fmt, {'dpi': dpi})
+                    else:
+                        p = ikigai_payload(i)
+                        img_data = chart_render.render_ikigai(
+                            p['labels'], p['overlap'], p['title'], fmt, {'dpi': dpi})
+                    elapsed = time.perf_counter() - start
+                    if i == 0:
+                        first = elapsed
+                    else:
+                        timings.append(elapsed)
+                    size = len(img_data)
+                results.append(summarize(name, timings, first_ms=first * 1000, bytes=size))
+                print(f"{name}: p50 {results[-1]['p50_ms']:.1f} ms, {size} bytes")
+
+    # The SVGs written without matplotlib
+    import svg_render
+    for kind, n in cases:
+        name = f"render/{kind}-direct" + (f"/n={n}" if n else '') + "/svg"
+        timings = []
+        for i in range(args.repeat):
+            p = wheel_payload(n, i) if kind == 'wheel' else ikigai_payload(i)
+            start = time.perf_counter()
+            img_data = svg_render.render(kind, p, 'svg')
+            timings.append(time.perf_counter() - start)
+        results.append(summarize(name, timings, bytes=len(img_data)))
+        print(f"{name}: p50 {results[-1]['p50_ms']:.3f} ms, {len(img_data)} bytes")
+    return results
+
+
+def start_local_server():
+    # Serve app.py on an ephemeral port in this process
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True,
+                         request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def post(url, payload, timeout):
+    body = json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            size = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as e:
+        size, status = len(e.read()), e.code
+    return time.perf_counter() - start, status, size
+
+
+def run_load(args):
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = start_local_server()
+
+    results = []
+    try:
+        for endpoint in args.endpoints:
+            # --unique gives every request its own title, so each one renders
+            # instead of hitting the cache
+            payloads = [payload_for(endpoint, args.n, i if args.unique else 0)
+                        for i in range(args.requests)]
+            post(base_url + endpoint, payloads[0], args.timeout)  # warm-up
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                outcomes = list(executor.map(
+                    lambda p: post(base_url + endpoint, p, args.timeout), payloads))
+            wall = time.perf_counter() - start
+
+            errors = sum(1 for _, status, _ in outcomes if status >= 400)
+            result = summarize(
+                f"load{endpoint}/c={args.concurrency}", [t for t, _, _ in outcomes],
+                throughput_rps=len(outcomes) / wall, errors=errors,
+                bytes=sum(size for _, _, size in outcomes))
+            results.append(result)
+            print(f"{endpoint}: {result['throughput_rps']:.1f} req/s, p50 {result['p50_ms']:.1f} ms, "
+                  f"p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, {errors} errors")
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+def run_compare(args):
+    with open(args.baseline) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    with open(args.current) as f:
+        current = {r['name']: r for r in json.load(f)['results']}
+
+    slower = []
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name][args.metric], result[args.metric]
+        change = (after - before) / before if before else 0.0
+        flag = ' SLOWER' if change > args.threshold else ''
+        print(f"{name}: {before:.2f} -> {after:.2f} ms ({change:+.1%}){flag}")
+        if flag:
+            slower.append(name)
+
+    if slower:
+        print(f"{len(slower)} benchmark(s) slower than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark chart rendering and the HTTP endpoints")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    render = commands.add_parser('render', help="time chart_render without HTTP")
+    render.add_argument('--categories', type=int, nargs='+', default=[4, 8, 16])
+    render.add_argument('--dpi', type=int, nargs='+', default=[100])
+    render.add_argument('--formats', nargs='+', default=['png', 'png8', 'svg', 'pdf'])
+    render.add_argument('--repeat', type=int, default=20)
+    render.add_argument('--output')
+
+    load = commands.add_parser('load', help="drive the endpoints over HTTP")
+    load.add_argument('--url', help="server to test; default starts app.py in-process")
+    load.add_argument('--endpoints', nargs='+', default=ENDPOINTS)
+    load.add_argument('--requests', type=int, default=200)
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--n', type=int, default=8, help="categories per wheel chart")
+    load.add_argument('--unique', action='store_true', help="bypass the render cache")
+    load.add_argument('--timeout', type=float, default=60)
+    load.add_argument('--output')
+
+    compare = commands.add_parser('compare', help="flag slowdowns between two result files")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--metric', default='p50_ms')
+    compare.add_argument('--threshold', type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        return run_compare(args)
+
+    results = run_render(args) if args.command == 'render' else run_load(args)
+    if args.output:
+        report = {
+            'command': args.command,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('command', 'output')},
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
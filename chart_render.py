@@ -0,0 +1,119 @@
+import chart_spec
+import encoding
+from figure_pool import pool
+
+# Shared drawing path for app.py, chart-app.py and Ikigai.py. Figures are
+# rendered through their own Agg canvas without pyplot, so it is safe to call
+# from several threads at once.
+
+
+def render_wheel(data_points, areas, title, fmt='png', options=None, **kwargs):
+    return draw(chart_spec.wheel(data_points, areas, title), fmt, options, **kwargs)
+
+
+def render_multi_wheel(scores, entities, areas, title, layout='grid', fmt='png',
+                       options=None, **kwargs):
+    # Wheels for every entity (row of scores) in one figure
+    return draw(chart_spec.multi_wheel(scores, entities, areas, title, layout),
+                fmt, options, **kwargs)
+
+
+def render_wheel_timeline(snapshots, areas, title, labels=None, steps=0, duration=1000,
+                          fmt='gif', options=None):
+    return draw(chart_spec.timeline(snapshots, areas, title, labels, steps, duration),
+                fmt, options)
+
+
+def render_ikigai(labels, overlap_labels, title, fmt='png', options=None, **kwargs):
+    return draw(chart_spec.ikigai(labels, overlap_labels, title), fmt, options, **kwargs)
+
+
+def _draw_wheel(spec, fmt, options, **kwargs):
+    # Reuse this thread's polar figure for the category count; the buffer is
+    # reused as well
+    template = pool.wheel(spec.layout.n)
+    template.update(spec)
+    return template.render(pool.buffer(), fmt, options, **kwargs)
+
+
+def _draw_multi_wheel(spec, fmt, options, **kwargs):
+    template = pool.multi_wheel(spec.arrangement, len(spec.entities), spec.layout.n)
+    template.update(spec)
+    return template.render(pool.buffer(), fmt, options, **kwargs)
+
+
+def _draw_timeline(spec, fmt, options):
+    # Every frame comes from one figure: only the bar heights and the label
+    # change between them
+    options = options or {}
+    template = pool.wheel_timeline(spec.layout.n)
+    images = template.frames(spec, options.get('dpi', 100))
+    return encoding.encode_animation(images, len(spec.frames), pool.buffer(), fmt,
+                                     spec.frame_duration, options)
+
+
+def _draw_ikigai(spec, fmt, options, **kwargs):
+    template = pool.ikigai()
+    template.update(spec)
+    return template.render(pool.buffer(), fmt, options, **kwargs)
+
+
+# Chart type -> matplotlib drawing of its compiled spec
+DRAWERS = {
+    'wheel': _draw_wheel,
+    'multi': _draw_multi_wheel,
+    'timeline': _draw_timeline,
+    'ikigai': _draw_ikigai,
+}
+
+
+def draw(spec, fmt='png', options=None, **kwargs):
+    data = DRAWERS[spec.kind](spec, fmt, options, **kwargs)
+    pool.release_large((options or {}).get('dpi', kwargs.get('dpi', 100)))
+    return data
+
+
+def render(kind, payload, fmt='png', options=None):
+    # Used by the cache and the request handlers
+    return draw(chart_spec.compile_chart(kind, payload), fmt, options)
+
+
+# Sample payloads from chart-app.py and Ikigai.py, used to warm up workers
+WARM_UP_PAYLOADS = {
+    'wheel': {
+        'data': [5, 7, 3, 8, 9, 4, 7, 6],
+        'categories': ["Health", "Relationships", "Career", "Finance", "Learning",
+                       "Leisure", "Physical Environment", "Personal Growth"],
+        'title': "Wheel of Life",
+    },
+    'multi': {
+        'data': [[5, 7, 3, 8], [6, 4, 9, 5]],
+        'entities': ["Alice", "Bob"],
+        'categories': ["Health", "Relationships", "Career", "Finance"],
+        'title': "Wheel of Life",
+        'layout': 'grid',
+    },
+    'timeline': {
+        'data': [[5, 7, 3, 8], [6, 4, 9, 5]],
+        'categories': ["Health", "Relationships", "Career", "Finance"],
+        'title': "Wheel of Life",
+        'labels': ["January", "February"],
+        'steps': 1,
+        'duration': 1000,
+    },
+    'ikigai': {
+        'labels': ['Love', 'World Needs', 'Good At', 'Paid For'],
+        'overlap': ['Passion', 'Mission', 'Profession', 'Vocation'],
+        'title': 'IKIGAI',
+    },
+}
+
+
+def warm_up():
+    # Build the templates, load fonts and the encoders of every output format
+    # before the first real request
+    for kind, payload in WARM_UP_PAYLOADS.items():
+        # Time series are only drawn as animations
+        formats = encoding.ANIMATED_FORMATS if kind == 'timeline' else encoding.FORMATS
+        for fmt in formats:
+            render(kind, payload, fmt)
@@ -0,0 +1,181 @@
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from chart_storage import INDEX_NAME, NOT_CHARTS, record_access
+
+# Directory app.py writes charts to, and the port to serve it on
+CHARTS_DIR = os.environ.get('CHARTS_DIR', 'charts')
+STATIC_PORT = int(os.environ.get('STATIC_PORT', 8080))
+
+# URL prefixes served from CHARTS_DIR; /images/ is what staticfile.py used
+PREFIXES = ('/charts/', '/images/')
+
+# Chart files never change once written, so clients may keep them for a year
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+logger = logging.getLogger(__name__)
+
+
+class ChartRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a page loading several charts reuses one connection
+    protocol_version = 'HTTP/1.1'
+    server_version = 'chart-server'
+    root = os.path.abspath(CHARTS_DIR)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _resolve(self):
+        path = unquote(urlsplit(self.path).path)
+        for prefix in PREFIXES:
+            if path.startswith(prefix):
+                relpath = posixpath.normpath(path[len(prefix):])
+                break
+        else:
+            return None
+
+        # No escaping the charts directory, no index, half-written files or
+        # markers, and no NUL bytes, which the OS rejects
+        name = posixpath.basename(relpath)
+        if (relpath.startswith(('..', '/')) or name.startswith(INDEX_NAME)
+                or name.endswith(NOT_CHARTS) or '\x00' in relpath):
+            return None
+        return os.path.join(self.root, *relpath.split('/'))
+
+    def _serve(self, send_body):
+        path = self._resolve()
+        try:
+            f = open(path, 'rb') if path is not None else None
+        except (OSError, ValueError):
+            # Missing files, directories, names the OS refuses
+            f = None
+        if f is None:
+            self._send_empty(HTTPStatus.NOT_FOUND)
+            return
+
+        with f:
+            stat = os.fstat(f.fileno())
+            record_access(f.fileno(), stat)
+            size = stat.st_size
+            etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+            last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+            if self._not_modified(etag, stat.st_mtime):
+                self._send_empty(HTTPStatus.NOT_MODIFIED, etag, last_modified)
+                return
+
+            status, start, length = HTTPStatus.OK, 0, size
+            byte_range = self._range(size, etag)
+            if byte_range == 'unsatisfiable':
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byte_range is not None:
+                status = HTTPStatus.PARTIAL_CONTENT
+                start, end = byte_range
+                length = end - start + 1
+
+            self.send_response(status)
+            self.send_header('Content-Type',
+                             mimetypes.guess_type(path)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', CACHE_CONTROL)
+            if status == HTTPStatus.PARTIAL_CONTENT:
+                self.send_header('Content-Range', f'bytes {start}-{start + length - 1}/{size}')
+            self.end_headers()
+
+            if send_body and length:
+                # Hand the file to the kernel (sendfile) instead of copying it
+                # through Python
+                self.wfile.flush()
+                self.connection.sendfile(f, start, length)
+
+    def _send_empty(self, status, etag=None, last_modified=None):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', CACHE_CONTROL)
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+            return '*' in tags or etag in tags
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def _range(self, size, etag):
+        # Single byte ranges only: (start, end), 'unsatisfiable' or None for the whole file
+        header = self.headers.get('Range')
+        if header is None:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range.strip() != etag:
+            return None
+
+        match = _RANGE.match(header.strip())
+        if match is None:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        elif last:
+            start = max(size - int(last), 0)
+            end = size - 1
+        else:
+            return None
+
+        if start >= size or start > end:
+            return 'unsatisfiable'
+        return start, end
+
+
+class ChartServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(levelname)s] - %(message)s')
+    server = ChartServer(('0.0.0.0', STATIC_PORT), ChartRequestHandler)
+    logger.info("Serving charts from '%s' on port %d", ChartRequestHandler.root, STATIC_PORT)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Server stopped")
+    finally:
+        server.server_close()
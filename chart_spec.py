@@ -0,0 +1,270 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+# Compile stage shared by the matplotlib and SVG renderers: a request payload
+# becomes an immutable spec holding the chart's geometry, colors and text, so
+# every backend draws the same chart without working any of it out again.
+
+# Text layouts kept per process, across backends
+LAYOUT_CACHE_SIZE = int(os.environ.get('LAYOUT_CACHE_SIZE', 1024))
+
+WHEEL_COLORS = ("#FF9999", "#66B2FF", "#99FF99", "#FFCC99",
+                "#FFD700", "#C71585", "#20B2AA", "#FF4500")
+WHEEL_ALPHA = 0.7
+# matplotlib's default bar color, for categories of a single wheel past the palette
+DEFAULT_COLOR = '#1f77b4'
+IKIGAI_COLORS = ('#FF9999', '#66B2FF', '#99FF99', '#FFCC99')
+
+# Inches per wheel in the small-multiples grid
+MULTI_CELL_SIZE = 2.5
+# Overlaid wheels: inches across the wheel, and per legend column of up to
+# OVERLAY_LEGEND_ROWS entities to its right
+OVERLAY_WHEEL_WIDTH = 5.6
+OVERLAY_LEGEND_COLUMN = 2.4
+OVERLAY_LEGEND_ROWS = 25
+
+
+@dataclass(frozen=True, eq=False)
+class WheelLayout:
+    # Geometry of every wheel with n categories: bar angles (counterclockwise
+    # from 3 o'clock), the angular width of each bar, and the bar colors of a
+    # single wheel and of small multiples, which cycle through the palette
+    n: int
+    theta: np.ndarray
+    width: float
+    colors: tuple
+    cycled_colors: tuple
+
+
+@lru_cache(maxsize=None)
+def wheel_layout(n):
+    theta = np.linspace(0.0, 2 * np.pi, n, endpoint=False)
+    theta.flags.writeable = False
+    colors = tuple((WHEEL_COLORS[i], WHEEL_ALPHA) if i < len(WHEEL_COLORS)
+                   else (DEFAULT_COLOR, 1.0) for i in range(n))
+    cycled_colors = tuple(WHEEL_COLORS[i % len(WHEEL_COLORS)] for i in range(n))
+    return WheelLayout(n, theta, np.pi / 4, colors, cycled_colors)
+
+
+@dataclass(frozen=True)
+class IkigaiLayout:
+    # Four circles placed diagonally around the center, in data coordinates
+    # shown over limits on both axes
+    radius: float
+    centers: tuple
+    label_positions: tuple
+    overlap_positions: tuple
+    colors: tuple
+    limits: tuple
+
+
+def multi_grid(entities):
+    # (rows, columns) of the small-multiples grid
+    cols = math.ceil(math.sqrt(entities))
+    return math.ceil(entities / cols), cols
+
+
+def legend_columns(entities):
+    return math.ceil(entities / OVERLAY_LEGEND_ROWS)
+
+
+def multi_figure_size(arrangement, entities):
+    # Figure size in inches of small multiples for this many entities
+    if arrangement == 'grid':
+        rows, cols = multi_grid(entities)
+        return cols * MULTI_CELL_SIZE, rows * MULTI_CELL_SIZE + 1.5
+    return OVERLAY_WHEEL_WIDTH + OVERLAY_LEGEND_COLUMN * legend_columns(entities), 6.0
+
+
+def _ikigai_layout(r=1.25, offset=0.6):
+    # offset is adjusted for the central intersection; labels sit at the
+    # outer edge of each circle
+    return IkigaiLayout(
+        radius=r,
+        centers=((0, offset), (-offset, 0), (0, -offset), (offset, 0)),
+        label_positions=((0, offset + r - 0.1), (-offset - r + 0.1, 0),
+                         (0, -offset - r + 0.1), (offset + r - 0.1, 0)),
+        overlap_positions=((-offset, offset), (-offset, -offset),
+                           (offset, -offset), (offset, offset)),
+        colors=IKIGAI_COLORS,
+        limits=(-2.5, 2.5),
+    )
+
+
+IKIGAI_LAYOUT = _ikigai_layout()
+
+
+@dataclass(frozen=True, eq=False)
+class WheelSpec:
+    kind = 'wheel'
+
+    layout: WheelLayout
+    values: np.ndarray
+    categories: tuple
+    title: str
+    # Outer radius that fits the longest bar
+    top: float
+
+    @property
+    def text_key(self):
+        # Everything the text layout depends on
+        return (self.kind, self.categories, self.title)
+
+
+@dataclass(frozen=True, eq=False)
+class MultiWheelSpec:
+    kind = 'multi'
+
+    layout: WheelLayout
+    # One row per entity, one column per category
+    values: np.ndarray
+    entities: tuple
+    categories: tuple
+    title: str
+    arrangement: str
+    top: float
+
+    @property
+    def text_key(self):
+        return (self.kind, self.arrangement, self.entities, self.categories, self.title)
+
+
+@dataclass(frozen=True, eq=False)
+class TimelineSpec:
+    kind = 'timeline'
+
+    layout: WheelLayout
+    # One row per frame, interpolated ones included, and each frame's label
+    frames: np.ndarray
+    frame_labels: tuple
+    categories: tuple
+    title: str
+    # Milliseconds per frame
+    frame_duration: int
+    top: float
+
+    @property
+    def text_key(self):
+        return (self.kind, self.categories, self.title)
+
+
+@dataclass(frozen=True)
+class IkigaiSpec:
+    kind = 'ikigai'
+
+    layout: IkigaiLayout
+    # Always four of each; like the original zip(), missing labels are empty
+    labels: tuple
+    overlaps: tuple
+    title: str
+
+    @property
+    def text_key(self):
+        return (self.kind, self.labels, self.overlaps, self.title)
+
+
+def _values(values):
+    values = np.array(values, dtype=float)
+    values.flags.writeable = False
+    return values
+
+
+def _top(values):
+    return max(float(values.max(initial=0.0)), 0.0) * 1.05 or 1.0
+
+
+def _padded(values, n):
+    return tuple(values[:n]) + ('',) * (n - len(values[:n]))
+
+
+def wheel(data_points, areas, title):
+    values = _values(data_points)
+    if values.shape != (len(areas),):
+        raise ValueError("'data' and 'categories' must have the same length")
+    return WheelSpec(wheel_layout(len(areas)), values, tuple(areas), title, _top(values))
+
+
+def multi_wheel(scores, entities, areas, title, arrangement='grid'):
+    values = _values(scores)
+    if values.shape != (len(entities), len(areas)):
+        raise ValueError("'data' must have one row per entity and one score per category")
+    return MultiWheelSpec(wheel_layout(len(areas)), values, tuple(entities), tuple(areas),
+                          title, arrangement, _top(values))
+
+
+def interpolate(snapshots, labels, steps):
+    # Insert steps frames between consecutive snapshots, moving the bars in
+    # equal steps; each frame keeps the label of the snapshot it starts from
+    if steps == 0 or len(snapshots) < 2:
+        return snapshots, list(labels)
+    t = np.arange(steps + 1) / (steps + 1)
+    start, end = snapshots[:-1, None, :], snapshots[1:, None, :]
+    frames = (start + (end - start) * t[:, None]).reshape(-1, snapshots.shape[1])
+    labels = [label for label in labels[:-1] for _ in range(steps + 1)] + [labels[-1]]
+    return np.concatenate([frames, snapshots[-1:]]), labels
+
+
+def timeline(snapshots, areas, title, labels=None, steps=0, duration=1000):
+    # duration is in milliseconds per snapshot, split over its frames
+    snapshots = np.asarray(snapshots, dtype=float)
+    if snapshots.ndim != 2 or snapshots.shape[1] != len(areas):
+        raise ValueError("'data' must have one score per category in every row")
+    labels = labels if labels is not None else [''] * len(snapshots)
+    frames, labels = interpolate(snapshots, labels, steps)
+    frames = _values(frames)
+    return TimelineSpec(wheel_layout(len(areas)), frames, tuple(labels), tuple(areas), title,
+                        max(duration // (steps + 1), 1), _top(frames))
+
+
+def ikigai(labels, overlap_labels, title):
+    return IkigaiSpec(IKIGAI_LAYOUT, _padded(labels, 4), _padded(overlap_labels, 4), title)
+
+
+# Chart type -> compiler of its normalized request payload
+COMPILERS = {
+    'wheel': lambda payload: wheel(payload['data'], payload['categories'], payload['title']),
+    'multi': lambda payload: multi_wheel(
+        payload['data'], payload['entities'], payload['categories'], payload['title'],
+        payload['layout']),
+    'timeline': lambda payload: timeline(
+        payload['data'], payload['categories'], payload['title'], payload['labels'],
+        payload['steps'], payload['duration']),
+    'ikigai': lambda payload: ikigai(payload['labels'], payload['overlap'], payload['title']),
+}
+
+
+def compile_chart(kind, payload):
+    return COMPILERS[kind](payload)
+
+
+class LayoutCache:
+    # Text layouts (margins, label positions, text outlines) by key, shared by
+    # the threads of a process. Working one out means measuring text, so each
+    # is computed once and reused by every figure or document with that text.
+    def __init__(self, max_entries=LAYOUT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        # Two threads may compute the same layout; both get the same result
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+layouts = LayoutCache()
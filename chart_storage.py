@@ -0,0 +1,217 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Charts older than this many seconds are deleted; 0 keeps them forever
+CHART_MAX_AGE = float(os.environ.get('CHART_MAX_AGE', 0))
+# Total bytes kept on disk before the least recently used charts are deleted; 0 is unlimited.
+# Every rendered chart is stored, so the default keeps CHARTS_DIR bounded.
+CHART_STORAGE_MAX_BYTES = int(os.environ.get('CHART_STORAGE_MAX_BYTES', 1024 * 1024 * 1024))
+# Reads are also recorded in the file's access time, at most this often, by
+# processes without the index (chart_server.py)
+ATIME_RESOLUTION = 60
+# Seconds between reaper runs
+CHART_REAP_INTERVAL = float(os.environ.get('CHART_REAP_INTERVAL', 60))
+
+INDEX_NAME = 'index.sqlite3'
+# Marker next to a chart file queued for writing, so every process sharing the
+# directory can tell it is on its way
+PENDING_SUFFIX = '.pending'
+# Files in the directory that are not charts: partial writes and markers
+NOT_CHARTS = ('.tmp', PENDING_SUFFIX)
+
+logger = logging.getLogger(__name__)
+
+
+def _atime(path):
+    try:
+        return os.stat(path).st_atime
+    except FileNotFoundError:
+        return 0.0
+
+
+def record_access(fd, stat):
+    # Bump the access time of an open chart file for the reaper, keeping its
+    # modification time (and so its ETag); skipped when it is recent already
+    now = time.time_ns()
+    if now - stat.st_atime_ns > ATIME_RESOLUTION * 1e9:
+        try:
+            os.utime(fd, ns=(now, stat.st_mtime_ns))
+        except OSError:
+            pass
+
+
+class ChartStorage:
+    # Chart files live in two levels of hashed subdirectories (ab/cd/abcd....png)
+    # so no directory grows past a few hundred entries. Sizes and access times
+    # are tracked in a small SQLite index next to them.
+    def __init__(self, directory, max_age=CHART_MAX_AGE,
+                 max_bytes=CHART_STORAGE_MAX_BYTES, reap_interval=CHART_REAP_INTERVAL):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.reap_interval = reap_interval
+        self.evictions = {'age': 0, 'quota': 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self._connect_lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._db.execute("CREATE TABLE IF NOT EXISTS charts ("
+                         "name TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                         "created REAL NOT NULL, accessed REAL NOT NULL) WITHOUT ROWID")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS charts_accessed ON charts (accessed)")
+        self._lock = threading.Lock()
+        # Access times are buffered and written to the index by the reaper
+        self._touched = {}
+        # [files, bytes] counted by the last reaper run, plus charts added
+        # since, and when they were counted; counting a large index is slow,
+        # and the metrics read these every second
+        self._totals = None
+        self._counted = 0.0
+        self._reaper = None
+
+    @property
+    def _db(self):
+        # Opened again after a fork; SQLite connections must not cross processes
+        with self._connect_lock:
+            if self._connection is None or self._pid != os.getpid():
+                self._connection = sqlite3.connect(
+                    os.path.join(self.directory, INDEX_NAME),
+                    check_same_thread=False, isolation_level=None)
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("PRAGMA synchronous=NORMAL")
+                self._pid = os.getpid()
+            return self._connection
+
+    def relpath(self, filename):
+        return f"{filename[:2]}/{filename[2:4]}/{filename}"
+
+    def path(self, relpath):
+        return os.path.join(self.directory, relpath)
+
+    def add(self, relpath, size):
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO charts VALUES (?, ?, ?, ?)",
+                             (relpath, size, now, now))
+            if self._totals is not None:
+                self._totals[0] += 1
+                self._totals[1] += size
+
+    def touch(self, relpath):
+        # Access times only matter for quota eviction
+        if self.max_bytes <= 0:
+            return
+        with self._lock:
+            self._touched[relpath] = time.time()
+
+    def _flush_touched(self):
+        touched, self._touched = self._touched, {}
+        if touched:
+            self._db.executemany("UPDATE charts SET accessed = ? WHERE name = ?",
+                                 [(accessed, name) for name, accessed in touched.items()])
+
+    def _delete(self, names):
+        for name in names:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+        self._db.executemany("DELETE FROM charts WHERE name = ?",
+                             [(name,) for name in names])
+
+    def reap(self):
+        with self._lock:
+            self._flush_touched()
+
+            if self.max_age > 0:
+                expired = [name for name, in self._db.execute(
+                    "SELECT name FROM charts WHERE created < ?",
+                    (time.time() - self.max_age,))]
+                self._delete(expired)
+                self.evictions['age'] += len(expired)
+
+            if self.max_bytes > 0:
+                total = self._total_bytes()
+                # Least recently used first, until the quota is met. A file
+                # read since its last recorded access is kept and its access
+                # time updated instead.
+                evicted, refreshed = [], []
+                for name, size, accessed in self._db.execute(
+                        "SELECT name, size, accessed FROM charts ORDER BY accessed"):
+                    if total <= self.max_bytes:
+                        break
+                    atime = _atime(self.path(name))
+                    if atime > accessed + ATIME_RESOLUTION:
+                        refreshed.append((atime, name))
+                        continue
+                    evicted.append(name)
+                    total -= size
+                self._db.executemany("UPDATE charts SET accessed = ? WHERE name = ?", refreshed)
+                self._delete(evicted)
+                self.evictions['quota'] += len(evicted)
+
+            self._count()
+
+    def scan(self):
+        # Index chart files written before the index existed, including the
+        # old flat uuid4 files
+        known = {name for name, in self._db.execute("SELECT name FROM charts")}
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.startswith(INDEX_NAME) or filename.endswith(NOT_CHARTS):
+                    continue
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                if name not in known:
+                    stat = os.stat(path)
+                    found.append((name, stat.st_size, stat.st_mtime, stat.st_mtime))
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO charts VALUES (?, ?, ?, ?)", found)
+        return len(found)
+
+    def _total_bytes(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM charts").fetchone()[0]
+
+    def _count(self):
+        self._totals = list(self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM charts").fetchone())
+        self._counted = time.monotonic()
+
+    def stats(self):
+        # Totals as of the last reaper run; counted here only when no reaper
+        # has done so for a whole interval
+        with self._lock:
+            if self._totals is None or time.monotonic() - self._counted > self.reap_interval:
+                self._count()
+            files, size = self._totals
+            return {"files": files, "bytes": size, "max_bytes": self.max_bytes,
+                    "max_age": self.max_age, "evictions": dict(self.evictions)}
+
+    def start(self):
+        if self._reaper is not None:
+            return
+        if self.max_age <= 0 and self.max_bytes <= 0:
+            return
+
+        self._reaper = threading.Thread(target=self._run, name='chart-reaper',
+                                        daemon=True)
+        self._reaper.start()
+
+    def _run(self):
+        # A fresh index picks up the files already on disk
+        if self.stats()["files"] == 0:
+            self.scan()
+
+        while True:
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Chart reaper failed")
+            time.sleep(self.reap_interval)
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from chart_storage import PENDING_SUFFIX
+
+# Background threads writing chart files to CHARTS_DIR
+CHART_WRITER_THREADS = int(os.environ.get('CHART_WRITER_THREADS', 4))
+# Writes allowed in the background; past this, writes happen on the request thread
+CHART_WRITER_MAX_PENDING = int(os.environ.get('CHART_WRITER_MAX_PENDING', 256))
+# Seconds after which a pending marker is taken for one left behind by a
+# process that died before writing the chart
+PENDING_MAX_AGE = 60
+# Seconds between checks for a chart another process is writing
+WAIT_POLL = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write(path, data):
+    # Write to a temporary name and rename, so readers never see a partial file
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _marker_age(path):
+    try:
+        return time.time() - os.stat(path + PENDING_SUFFIX).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+class ChartWriter:
+    def __init__(self, threads=CHART_WRITER_THREADS, max_pending=CHART_WRITER_MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=threads,
+                                            thread_name_prefix='chart-writer')
+        # path -> (data, event set once the file is on disk or the write failed)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def write(self, path, data, on_done=None):
+        # on_done is called once the file is in place
+        with self._lock:
+            if path in self._pending:
+                return
+            background = len(self._pending) < self.max_pending
+            if background:
+                self._pending[path] = (data, threading.Event())
+
+        if background:
+            # Other processes only see the marker; this one has _pending too
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                open(path + PENDING_SUFFIX, 'wb').close()
+            except OSError:
+                logger.warning("Could not mark chart %s as pending", path)
+            self._executor.submit(self._write, path, data, on_done)
+        else:
+            with metrics.stage('write'):
+                atomic_write(path, data)
+            if on_done is not None:
+                on_done()
+
+    def _write(self, path, data, on_done):
+        try:
+            with metrics.stage('write'):
+                atomic_write(path, data)
+            if on_done is not None:
+                on_done()
+        except Exception:
+            logger.exception("Failed to write chart %s", path)
+        finally:
+            try:
+                os.remove(path + PENDING_SUFFIX)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                _, done = self._pending.pop(path)
+            done.set()
+
+    def backlog(self):
+        # Number of files still waiting to be written
+        with self._lock:
+            return len(self._pending)
+
+    def pending(self, path):
+        # Bytes of a chart that is still being written, else None
+        with self._lock:
+            entry = self._pending.get(path)
+        return entry[0] if entry is not None else None
+
+    def in_flight(self, path):
+        # True while this process, or another one writing to the same
+        # directory, still has the chart queued
+        with self._lock:
+            if path in self._pending:
+                return True
+        age = _marker_age(path)
+        if age is not None and age >= PENDING_MAX_AGE:
+            try:
+                os.remove(path + PENDING_SUFFIX)
+            except FileNotFoundError:
+                pass
+            return False
+        return age is not None
+
+    def wait(self, path, timeout=None):
+        # Block until a pending write finishes, in this process or another;
+        # True if the file is on disk
+        with self._lock:
+            entry = self._pending.get(path)
+        if entry is not None:
+            if not entry[1].wait(timeout):
+                return False
+        else:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            while self.in_flight(path):
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                time.sleep(WAIT_POLL)
+        return os.path.exists(path)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
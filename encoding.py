@@ -0,0 +1,193 @@
+import math
+import os
+
+import metrics
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow formats are optional
+    Image = None
+
+# zlib level for PNG output (0-9); lower is faster, higher is smaller
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', 6))
+# Quality for lossy formats (1-100)
+LOSSY_QUALITY = int(os.environ.get('LOSSY_QUALITY', 85))
+# Colors kept in palette PNGs; the charts only use a handful of flat colors
+PALETTE_COLORS = int(os.environ.get('PALETTE_COLORS', 64))
+# Per-request dpi range
+MIN_DPI = int(os.environ.get('MIN_DPI', 36))
+MAX_DPI = int(os.environ.get('MAX_DPI', 300))
+
+# Output format -> response content type
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'png8': 'image/png',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'svg': 'image/svg+xml',
+    'pdf': 'application/pdf',
+    'gif': 'image/gif',
+    'apng': 'image/png',
+    'sprite': 'image/png',
+}
+
+# Output format -> file extension for stored charts
+EXTENSIONS = {
+    'png': 'png',
+    'png8': 'png',
+    'webp': 'webp',
+    'jpeg': 'jpg',
+    'svg': 'svg',
+    'pdf': 'pdf',
+    'gif': 'gif',
+    'apng': 'png',
+    'sprite': 'png',
+}
+
+# Formats rendered through the raster pipeline below rather than savefig
+RASTER_FORMATS = ('png', 'png8', 'webp', 'jpeg')
+# Formats of time-series charts: an animated GIF or PNG, or all frames on one
+# PNG sprite sheet
+ANIMATION_FORMATS = ('gif', 'apng', 'sprite')
+
+
+def available_formats():
+    formats = ['png', 'svg', 'pdf']
+    if Image is not None:
+        formats += ['png8', 'jpeg']
+        if features.check('webp'):
+            formats.append('webp')
+    return formats
+
+
+FORMATS = available_formats()
+# Animations are put together by Pillow
+ANIMATED_FORMATS = list(ANIMATION_FORMATS) if Image is not None else []
+
+
+def _int_option(data, name, low, high):
+    try:
+        value = int(data[name])
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be an integer")
+    if not low <= value <= high:
+        raise ValueError(f"'{name}' must be between {low} and {high}")
+    return value
+
+
+def parse_options(data, formats=FORMATS, default='png'):
+    # Output format and encoding options of a request, as (fmt, options).
+    # Only options that were given end up in the dict, so requests without
+    # any keep their cache keys.
+    fmt = data.get('format', default)
+    if fmt not in formats:
+        raise ValueError(f"Unsupported output format, use one of: {', '.join(formats)}")
+
+    options = {}
+    if 'dpi' in data and fmt in RASTER_FORMATS + ANIMATION_FORMATS:
+        options['dpi'] = _int_option(data, 'dpi', MIN_DPI, MAX_DPI)
+    if 'compression' in data and fmt in ('png', 'png8', 'apng', 'sprite'):
+        options['compression'] = _int_option(data, 'compression', 0, 9)
+    if 'quality' in data and fmt in ('webp', 'jpeg'):
+        options['quality'] = _int_option(data, 'quality', 1, 100)
+    return fmt, options
+
+
+def encode(fig, buffer, fmt='png', options=None, **savefig_kwargs):
+    # Write the figure to buffer and return the bytes. Vector formats and
+    # script calls with savefig arguments go through savefig; API rasters are
+    # drawn once to the Agg buffer and handed to Pillow.
+    options = options or {}
+    buffer.seek(0)
+    buffer.truncate()
+
+    if fmt not in RASTER_FORMATS or savefig_kwargs or Image is None:
+        if 'dpi' in options:
+            savefig_kwargs.setdefault('dpi', options['dpi'])
+        with metrics.stage('savefig'):
+            fig.savefig(buffer, format=fmt if fmt in CONTENT_TYPES else 'png',
+                        **savefig_kwargs)
+        return buffer.getvalue()
+
+    with metrics.stage('draw'):
+        image = capture(fig, options.get('dpi', 100))
+
+    with metrics.stage('encode'):
+        if fmt == 'png':
+            image.save(buffer, 'PNG',
+                       compress_level=options.get('compression', PNG_COMPRESS_LEVEL))
+        elif fmt == 'png8':
+            # The figure background is opaque, so the alpha channel can go
+            quantize = getattr(Image, 'Quantize', Image)
+            palette = image.convert('RGB').quantize(PALETTE_COLORS,
+                                                    method=quantize.FASTOCTREE)
+            palette.save(buffer, 'PNG',
+                         compress_level=options.get('compression', PNG_COMPRESS_LEVEL))
+        elif fmt == 'webp':
+            image.convert('RGB').save(buffer, 'WEBP',
+                                      quality=options.get('quality', LOSSY_QUALITY))
+        else:
+            image.convert('RGB').save(buffer, 'JPEG',
+                                      quality=options.get('quality', LOSSY_QUALITY))
+    return buffer.getvalue()
+
+
+def capture(fig, dpi=100):
+    # Draw the figure and wrap its Agg buffer in a Pillow image without a
+    # copy; the image is only valid until the figure is drawn again
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    return canvas_image(fig)
+
+
+def canvas_image(fig):
+    # The Agg buffer as it is, for figures updated by blitting
+    width, height = fig.canvas.get_width_height()
+    return Image.frombuffer('RGBA', (width, height), fig.canvas.buffer_rgba(),
+                            'raw', 'RGBA', 0, 1)
+
+
+def encode_animation(frames, count, buffer, fmt, duration, options=None):
+    # Put count frames together as an animated GIF or PNG, or a sprite sheet
+    # with frames left to right, top to bottom in ceil(sqrt(count)) columns.
+    # frames yields captured images of one size; each is converted before the
+    # next one is drawn. duration is in milliseconds per frame.
+    options = options or {}
+    compress_level = options.get('compression', PNG_COMPRESS_LEVEL)
+    buffer.seek(0)
+    buffer.truncate()
+
+    if fmt == 'sprite':
+        sheet = None
+        columns = math.ceil(math.sqrt(count))
+        for i, frame in enumerate(frames):
+            if sheet is None:
+                width, height = frame.size
+                sheet = Image.new('RGB', (columns * width,
+                                          math.ceil(count / columns) * height), 'white')
+            with metrics.stage('encode'):
+                sheet.paste(frame.convert('RGB'), ((i % columns) * width,
+                                                   (i // columns) * height))
+        with metrics.stage('encode'):
+            sheet.save(buffer, 'PNG', compress_level=compress_level)
+        return buffer.getvalue()
+
+    images = []
+    for frame in frames:
+        with metrics.stage('encode'):
+            if fmt == 'gif':
+                # Palette frames take a third of the memory of RGB ones
+                quantize = getattr(Image, 'Quantize', Image)
+                images.append(frame.convert('RGB').quantize(PALETTE_COLORS,
+                                                            method=quantize.FASTOCTREE))
+            else:
+                images.append(frame.convert('RGB'))
+
+    with metrics.stage('encode'):
+        if fmt == 'gif':
+            images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:],
+                           duration=duration, loop=0)
+        else:
+            images[0].save(buffer, 'PNG', save_all=True, append_images=images[1:],
+                           duration=duration, loop=0, compress_level=compress_level)
+    return buffer.getvalue()
@@ -0,0 +1,441 @@
+import gc
+import io
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from matplotlib import colormaps, rcParams
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle, Patch
+
+import chart_spec
+import encoding
+import metrics
+
+# Wheel templates depend on the category count; keep a few per worker
+MAX_WHEEL_TEMPLATES = int(os.environ.get('MAX_WHEEL_TEMPLATES', 8))
+# A template keeps an Agg buffer the size of its last render; ones drawn
+# bigger than this many pixels are dropped after the render instead
+MAX_TEMPLATE_PIXELS = int(os.environ.get('MAX_TEMPLATE_PIXELS', 3000 * 3000))
+
+# Points along the outer arc of each bar drawn as a polygon
+ARC_STEPS = 16
+
+# PDFs embed subsets of the TrueType fonts instead of drawing every glyph as
+# a Type 3 procedure; the text stays text for print
+rcParams['pdf.fonttype'] = 42
+
+# Every figure this process has built and not yet freed, to spot leaks
+_live_figures = weakref.WeakSet()
+
+
+def wedge_vertices(theta, width, radii):
+    # Polygons in (theta, r) for bars of the given radii, shape (..., n) ->
+    # (..., n, ARC_STEPS + 2, 2): the center, then points along the outer arc
+    angles = theta[:, None] + width * np.linspace(-0.5, 0.5, ARC_STEPS)
+    verts = np.zeros(radii.shape + (ARC_STEPS + 2, 2))
+    verts[..., 1:-1, 0] = angles
+    verts[..., 1:-1, 1] = radii[..., None]
+    verts[..., 0, 0] = angles[:, 0]
+    verts[..., -1, 0] = angles[:, -1]
+    return verts
+
+
+def fit_layout(fig, key, rect=None):
+    # tight_layout measures every piece of text in the figure. Its margins
+    # only depend on the text and the figure size, so they are worked out once
+    # per text key and applied to later figures with the same text directly.
+    def fit():
+        # tight_layout starts from the current margins; start from the
+        # defaults so the result does not depend on what was drawn before
+        fig.subplots_adjust(**{side: rcParams[f'figure.subplot.{side}']
+                               for side in ('left', 'right', 'bottom', 'top')})
+        fig.tight_layout(rect=rect)
+        params = fig.subplotpars
+        return {'left': params.left, 'right': params.right,
+                'bottom': params.bottom, 'top': params.top}
+
+    size = tuple(fig.get_size_inches())
+    fig.subplots_adjust(**chart_spec.layouts.get(('agg', key, size, rect), fit))
+
+
+class WheelTemplate:
+    # Figure area tight_layout fits the wheel into
+    layout_rect = None
+
+    def __init__(self, n):
+        self.n = n
+        layout = chart_spec.wheel_layout(n)
+
+        self.fig = _new_figure(figsize=(6, 6))
+        self.ax = ax = self.fig.add_subplot(projection='polar')
+        self.bars = ax.bar(layout.theta, np.zeros(n), width=layout.width, bottom=0.0,
+                           align='center', edgecolor='gray', linewidth=0.5)
+
+        # A clearer color palette - can be customized
+        for bar, (color, alpha) in zip(self.bars, layout.colors):
+            bar.set_facecolor(color)
+            bar.set_alpha(alpha)
+
+        # Remove gridlines and outer circle (spine)
+        ax.yaxis.grid(False)
+        ax.xaxis.grid(False)
+        ax.spines["polar"].set_visible(False)
+
+        ax.set_yticklabels([])
+        ax.set_xticks(layout.theta)
+        ax.set_title('', va='bottom', fontdict={
+                     'fontsize': 14, 'fontweight': 'bold'})
+
+        # Text key of the labels and title the figure is laid out for
+        self._layout_key = None
+
+    def _check(self, spec):
+        if spec.layout.n != self.n:
+            raise ValueError("'data' and 'categories' must have the same length")
+
+    def update(self, spec):
+        self._check(spec)
+        with metrics.stage('update'):
+            for bar, radius in zip(self.bars, spec.values):
+                bar.set_height(radius)
+            self.ax.relim()
+            self.ax.autoscale_view()
+        self._update_text(spec)
+
+    def _update_text(self, spec):
+        if spec.text_key != self._layout_key:
+            with metrics.stage('layout'):
+                self.ax.set_xticklabels(spec.categories, fontdict={
+                    'fontsize': 10, 'fontweight': 'bold', 'color': '#555555'})
+                self.ax.title.set_text(spec.title)
+                # Padding only changes when the text does
+                fit_layout(self.fig, spec.text_key, self.layout_rect)
+            self._layout_key = spec.text_key
+
+    def render(self, buffer, fmt='png', options=None, **kwargs):
+        return encoding.encode(self.fig, buffer, fmt, options, **kwargs)
+
+
+class WheelTimelineTemplate(WheelTemplate):
+    # A wheel whose frames only differ in bar heights and the snapshot label
+    # underneath, drawn on one radial scale so the bars can be compared
+    layout_rect = (0, 0.06, 1, 1)
+
+    def __init__(self, n):
+        super().__init__(n)
+        self.caption = self.fig.text(0.5, 0.02, '', ha='center', va='bottom',
+                                     fontsize=12, fontweight='bold', color='#555555')
+        # Left out of full draws; frames draw them over the cached background
+        for artist in [*self.bars, self.caption]:
+            artist.set_animated(True)
+
+    def frames(self, spec, dpi=100):
+        # Yield each frame of the spec drawn as an image that is only valid
+        # until the next one is drawn. The axes, category labels and title are
+        # drawn once; every frame restores them and draws the bars and label on
+        # top.
+        self._check(spec)
+        self._update_text(spec)
+        self.ax.set_ylim(0, spec.top)
+        canvas = self.fig.canvas
+        with metrics.stage('draw'):
+            self.fig.set_dpi(dpi)
+            canvas.draw()
+            background = canvas.copy_from_bbox(self.fig.bbox)
+
+        for radii, label in zip(spec.frames, spec.frame_labels):
+            with metrics.stage('update'):
+                for bar, radius in zip(self.bars, radii):
+                    bar.set_height(radius)
+                self.caption.set_text(label)
+            with metrics.stage('draw'):
+                canvas.restore_region(background)
+                for bar in self.bars:
+                    self.ax.draw_artist(bar)
+                self.fig.draw_artist(self.caption)
+                image = encoding.canvas_image(self.fig)
+            yield image
+
+
+class IkigaiTemplate:
+    def __init__(self):
+        layout = chart_spec.IKIGAI_LAYOUT
+        self.fig = _new_figure(figsize=(10, 10))
+        self.ax = ax = self.fig.add_subplot()
+
+        for center, color in zip(layout.centers, layout.colors):
+            ax.add_patch(Circle(center, layout.radius, color=color, alpha=0.4))
+
+        # Each circle's label at its outer edge
+        self.labels = [ax.text(x, y, '', ha='center', va='center',
+                               fontsize=9, fontweight='bold')
+                       for x, y in layout.label_positions]
+
+        # Text for the overlaps
+        self.overlaps = [ax.text(x, y, '', ha='center', va='center',
+                                 fontsize=9, fontweight='bold',
+                                 backgroundcolor='white', zorder=5)
+                         for x, y in layout.overlap_positions]
+
+        # Highlight central IKIGAI text
+        self.title = ax.text(0, 0, '', ha='center', va='center', fontsize=20,
+                             fontweight='bold', color='#555555', zorder=5,
+                             backgroundcolor='white')
+
+        ax.set_xlim(*layout.limits)
+        ax.set_ylim(*layout.limits)
+        ax.set_aspect('equal', 'box')
+        ax.axis('off')
+
+        self._layout_key = None
+
+    def update(self, spec):
+        with metrics.stage('update'):
+            for text, label in zip(self.labels, spec.labels):
+                text.set_text(label)
+            for text, label in zip(self.overlaps, spec.overlaps):
+                text.set_text(label)
+            self.title.set_text(spec.title)
+
+        if spec.text_key != self._layout_key:
+            with metrics.stage('layout'):
+                fit_layout(self.fig, spec.text_key)
+            self._layout_key = spec.text_key
+
+    def render(self, buffer, fmt='png', options=None, **kwargs):
+        return encoding.encode(self.fig, buffer, fmt, options, **kwargs)
+
+
+class MultiWheelTemplate:
+    # Wheels of several entities in one figure: a grid of small multiples, or
+    # all of them overlaid on one wheel. Each axes draws its bars as a single
+    # PolyCollection whose vertices are computed for all entities at once.
+    def __init__(self, arrangement, entities, n):
+        self.arrangement = arrangement
+        self.shape = (entities, n)
+        layout = chart_spec.wheel_layout(n)
+
+        self.fig = _new_figure(figsize=chart_spec.multi_figure_size(arrangement, entities))
+        if arrangement == 'grid':
+            rows, cols = chart_spec.multi_grid(entities)
+            axes = self.fig.subplots(rows, cols, squeeze=False,
+                                     subplot_kw={'projection': 'polar'}).ravel()
+            for ax in axes[entities:]:
+                ax.set_visible(False)
+            self.axes = list(axes[:entities])
+            # Every wheel colors its categories the same way
+            colors = list(layout.cycled_colors)
+            self.collections = [self._add_bars(ax, colors, 'gray', chart_spec.WHEEL_ALPHA)
+                                for ax in self.axes]
+            for ax in self.axes:
+                ax.set_xticks([])
+                ax.set_title('', fontsize=10, fontweight='bold', color='#555555')
+            self.legend = self.fig.legend(
+                [Patch(facecolor=color, alpha=chart_spec.WHEEL_ALPHA) for color in colors],
+                [''] * n, loc='lower center', ncol=min(n, 4), frameon=False, fontsize=10)
+            # Fixed margins: tight_layout over dozens of polar axes costs more
+            # than the render
+            height = self.fig.get_figheight()
+            self.fig.subplots_adjust(left=0.02, right=0.98, bottom=1.0 / height,
+                                     top=1 - 0.9 / height, wspace=0.3, hspace=0.4)
+        else:
+            ax = self.fig.add_subplot(projection='polar')
+            self.axes = [ax]
+            # The strong tab20 colors first, then their lighter pairs
+            palette = colormaps['tab20'].colors
+            colors = _cycled(palette[0::2] + palette[1::2], entities)
+            # One polygon per entity and category, colored by entity
+            bar_colors = np.repeat(colors, n, axis=0)
+            self.collections = [self._add_bars(ax, bar_colors, bar_colors, 0.25)]
+            ax.set_xticks(layout.theta)
+            self.legend = self.fig.legend(
+                [Patch(facecolor=color, alpha=0.6) for color in colors], [''] * entities,
+                loc='center right', ncol=chart_spec.legend_columns(entities), frameon=False,
+                fontsize=9)
+            # The figure grows to the right with every legend column; the
+            # wheel keeps its place and size
+            width = self.fig.get_figwidth()
+            self.fig.subplots_adjust(left=0.4 / width,
+                                     right=chart_spec.OVERLAY_WHEEL_WIDTH / width,
+                                     bottom=0.08, top=0.88)
+
+        for ax in self.axes:
+            ax.yaxis.grid(False)
+            ax.xaxis.grid(False)
+            ax.spines["polar"].set_visible(False)
+            ax.set_yticklabels([])
+        self.title = self.fig.suptitle('', fontsize=14, fontweight='bold')
+
+        self._layout_key = None
+
+    @staticmethod
+    def _add_bars(ax, facecolors, edgecolors, alpha):
+        collection = PolyCollection([], facecolors=facecolors, edgecolors=edgecolors,
+                                    linewidths=0.5, alpha=alpha)
+        ax.add_collection(collection, autolim=False)
+        return collection
+
+    def update(self, spec):
+        if spec.values.shape != self.shape:
+            raise ValueError("'data' must have one row per entity and one score per category")
+
+        with metrics.stage('update'):
+            verts = wedge_vertices(spec.layout.theta, spec.layout.width, spec.values)
+            if self.arrangement == 'grid':
+                for collection, entity_verts in zip(self.collections, verts):
+                    collection.set_verts(entity_verts)
+            else:
+                self.collections[0].set_verts(verts.reshape(-1, ARC_STEPS + 2, 2))
+            # All wheels share one radial scale so they can be compared
+            for ax in self.axes:
+                ax.set_ylim(0, spec.top)
+
+        if spec.text_key != self._layout_key:
+            with metrics.stage('layout'):
+                if self.arrangement == 'grid':
+                    for ax, entity in zip(self.axes, spec.entities):
+                        ax.title.set_text(entity)
+                    labels = spec.categories
+                else:
+                    self.axes[0].set_xticklabels(spec.categories, fontdict={
+                        'fontsize': 10, 'fontweight': 'bold', 'color': '#555555'})
+                    labels = spec.entities
+                for text, label in zip(self.legend.get_texts(), labels):
+                    text.set_text(label)
+                self.title.set_text(spec.title)
+            self._layout_key = spec.text_key
+
+    def render(self, buffer, fmt='png', options=None, **kwargs):
+        return encoding.encode(self.fig, buffer, fmt, options, **kwargs)
+
+
+def _cycled(colors, n):
+    return [colors[i % len(colors)] for i in range(n)]
+
+
+def _new_figure(**kwargs):
+    # Figures are built without pyplot, so nothing is registered globally and
+    # a template is freed as soon as the pool drops it
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    _live_figures.add(fig)
+    return fig
+
+
+def live_figures():
+    return len(_live_figures)
+
+
+class FigurePool:
+    # Templates are not shared between threads; each thread gets its own set,
+    # so renders can run concurrently without a global lock
+    def __init__(self, max_wheel_templates=MAX_WHEEL_TEMPLATES,
+                 max_template_pixels=MAX_TEMPLATE_PIXELS):
+        self.max_wheel_templates = max_wheel_templates
+        self.max_template_pixels = max_template_pixels
+        self._local = threading.local()
+
+    def _templates(self):
+        if not hasattr(self._local, 'wheels'):
+            self._local.wheels = OrderedDict()
+            self._local.ikigai = None
+            self._local.buffer = io.BytesIO()
+            # Key of the template handed out last, and whether this thread
+            # let go of a template since the last collection
+            self._local.current = None
+            self._local.dropped = False
+        return self._local
+
+    @contextmanager
+    def guard(self):
+        # Wraps one render. A template that raised part way through is dropped
+        # rather than reused half updated, and dropped templates are collected
+        # right away: a figure, its canvas and its axes reference each other,
+        # so they would otherwise stay in memory until the cyclic collector
+        # happens to run. A template dropped on error is still referenced by
+        # the traceback, so it is collected when the next render starts.
+        local = self._templates()
+        self._collect(local)
+        local.current = None
+        try:
+            yield
+        except BaseException:
+            self._discard(local)
+            raise
+        self._collect(local)
+
+    def _collect(self, local):
+        if local.dropped:
+            local.dropped = False
+            with metrics.stage('collect'):
+                gc.collect()
+
+    def _discard(self, local):
+        if local.current == 'ikigai':
+            local.ikigai = None
+        elif local.current is not None:
+            local.wheels.pop(local.current, None)
+        else:
+            return
+        local.current = None
+        local.dropped = True
+
+    def release_large(self, dpi):
+        # Drop the template just rendered if it was drawn at a size whose
+        # buffer is not worth keeping around
+        local = self._templates()
+        if local.current == 'ikigai':
+            template = local.ikigai
+        else:
+            template = local.wheels.get(local.current)
+        if template is None:
+            return
+        width, height = template.fig.get_size_inches()
+        if width * dpi * height * dpi > self.max_template_pixels:
+            self._discard(local)
+
+    def buffer(self):
+        return self._templates().buffer
+
+    def wheel(self, n):
+        return self._wheel(n, lambda: WheelTemplate(n))
+
+    def wheel_timeline(self, n):
+        return self._wheel(('timeline', n), lambda: WheelTimelineTemplate(n))
+
+    def multi_wheel(self, arrangement, entities, n):
+        # Shares the wheel LRU, keyed by arrangement and shape
+        return self._wheel((arrangement, entities, n),
+                           lambda: MultiWheelTemplate(arrangement, entities, n))
+
+    def _wheel(self, key, build):
+        local = self._templates()
+        template = local.wheels.get(key)
+        if template is None:
+            with metrics.stage('build'):
+                template = build()
+            local.wheels[key] = template
+            if len(local.wheels) > self.max_wheel_templates:
+                local.wheels.popitem(last=False)
+                local.dropped = True
+        else:
+            local.wheels.move_to_end(key)
+        local.current = key
+        return template
+
+    def ikigai(self):
+        local = self._templates()
+        if local.ikigai is None:
+            with metrics.stage('build'):
+                local.ikigai = IkigaiTemplate()
+        local.current = 'ikigai'
+        return local.ikigai
+
+
+pool = FigurePool()
@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+# Production server settings, read by `gunicorn app:app` from the working
+# directory. Everything is configured through the environment, next to API_PORT.
+
+bind = f"0.0.0.0:{os.environ.get('API_PORT', 80)}"
+
+# Web worker processes, and threads per process for the gthread worker class
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('WEB_THREADS', 8))
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+
+# Seconds an idle keep-alive connection stays open
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+# Seconds a silent worker gets before it is killed and replaced; longer than
+# RENDER_TIMEOUT and CHART_WAIT_TIMEOUT
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+# Seconds workers get to finish their requests on restart or HUP reload
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+
+# Replace each web worker after this many requests (0 never), give or take
+# the jitter so they do not all restart at once
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', max_requests // 10))
+# ... or once it grows past this many MiB (0 no limit)
+WEB_MAX_RSS_MB = int(os.environ.get('WEB_MAX_RSS_MB', 1024))
+
+# Import the app once in the master and fork the workers from it; render
+# processes, the SQLite index and the reaper are started per worker below
+preload_app = os.environ.get('WEB_PRELOAD', '1') == '1'
+
+# Request line and header limits; body size is MAX_REQUEST_BYTES in app.py
+limit_request_line = int(os.environ.get('WEB_LIMIT_REQUEST_LINE', 4094))
+limit_request_fields = int(os.environ.get('WEB_LIMIT_REQUEST_FIELDS', 100))
+limit_request_field_size = int(os.environ.get('WEB_LIMIT_REQUEST_FIELD_SIZE', 8190))
+
+accesslog = os.environ.get('WEB_ACCESS_LOG') or None
+errorlog = '-'
+
+# Split the CPUs between the web workers' render pools instead of giving
+# each of them one render process per CPU
+os.environ.setdefault('RENDER_WORKERS', str(max((os.cpu_count() or 1) // workers, 1)))
+
+# Web workers write their metrics to files here and /metrics adds them up,
+# whichever worker answers it
+os.environ.setdefault('METRICS_DIR',
+                      os.path.join(tempfile.gettempdir(), f'chart-metrics-{os.getpid()}'))
+# ... and mark themselves here until they are warm, so /readyz waits for all of them
+os.environ.setdefault('READY_DIR',
+                      os.path.join(tempfile.gettempdir(), f'chart-ready-{os.getpid()}'))
+
+
+def on_starting(server):
+    import metrics
+    import readiness
+
+    metrics.registry.clear()
+    readiness.clear()
+
+
+def post_fork(server, worker):
+    import readiness
+
+    readiness.warming()
+
+
+def post_worker_init(worker):
+    import app
+
+    app.chart_storage.start()
+    app.render_pool.start()
+    app.metrics.registry.start()
+    app.readiness.warmed_when_set(app.render_pool.warmed)
+
+
+def post_request(worker, req, environ, resp):
+    # Like max_requests: the worker stops accepting connections, finishes the
+    # requests it has and exits, and the arbiter starts a fresh one
+    import metrics
+
+    if WEB_MAX_RSS_MB and worker.alive and metrics.rss_bytes() > WEB_MAX_RSS_MB * 1024 * 1024:
+        worker.log.info("Worker %s uses more than %d MiB, restarting", worker.pid, WEB_MAX_RSS_MB)
+        worker.alive = False
+
+
+def worker_exit(server, worker):
+    # Let queued chart files reach the disk and the render processes finish
+    import app
+
+    app.chart_writer.shutdown()
+    app.render_pool.shutdown()
+    app.metrics.registry.flush()
+
+
+def child_exit(server, worker):
+    # Runs in the master: keep the exited worker's counts in the totals, and
+    # stop waiting for it to warm up
+    import metrics
+    import readiness
+
+    metrics.registry.retire(worker.pid)
+    readiness.warmed(worker.pid)
+
+
+def on_exit(server):
+    import metrics
+    import readiness
+
+    metrics.registry.clear()
+    readiness.clear()
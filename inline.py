@@ -0,0 +1,61 @@
+import base64
+import os
+import zlib
+
+# Bytes of image encoded per chunk; a multiple of 3, so every chunk encodes
+# to base64 on its own without padding
+INLINE_CHUNK = 48 * 1024
+# Smallest body worth gzipping, and the zlib level used
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+
+TEXT = 'text/plain'
+JSON = 'application/json'
+
+
+def negotiate(accept, content_type):
+    # Pick the representation from the Accept header: the raw image, a JSON
+    # data URI, or plain base64 text (the default, for existing clients)
+    best = accept.best_match([TEXT, JSON, content_type], default=TEXT)
+    if best == content_type:
+        return 'binary'
+    if best == JSON:
+        return 'json'
+    return 'text'
+
+
+def base64_chunks(data, prefix=b'', suffix=b''):
+    # Encode straight from the render buffer, one slice at a time
+    view = memoryview(data)
+    if prefix:
+        yield prefix
+    for start in range(0, len(view), INLINE_CHUNK):
+        yield base64.b64encode(view[start:start + INLINE_CHUNK])
+    if suffix:
+        yield suffix
+
+
+DATA_URI_SUFFIX = b'"}'
+
+
+def data_uri_prefix(content_type):
+    return b'{"data_uri":"data:' + content_type.encode('ascii') + b';base64,'
+
+
+def data_uri_chunks(data, content_type):
+    return base64_chunks(data, data_uri_prefix(content_type), DATA_URI_SUFFIX)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def worth_gzipping(mode, content_type, size):
+    # Base64 and SVG text compress well; PNG, WebP and JPEG are already compressed
+    compressible = mode != 'binary' or content_type == 'image/svg+xml'
+    return compressible and size >= GZIP_MIN_BYTES
@@ -0,0 +1,387 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Add a Server-Timing header with the per-stage durations to every response
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+# Directory shared by the processes of one server (gunicorn's web workers):
+# each writes its values to a file there and /metrics adds them up. Unset
+# keeps the metrics of this process only.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+# Seconds between writes of this process's values to METRICS_DIR
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+# Counters and histograms of exited processes, in METRICS_DIR
+ARCHIVE_NAME = 'archive.json'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _add(a, b):
+    # Sums counter values and histogram [bucket counts, sum, count] entries alike
+    if isinstance(a, list):
+        return [_add(x, y) for x, y in zip(a, b)]
+    return a + b
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def collect(self):
+        # {label values: value} at this moment
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, totals, key, value):
+        # Add another process's value for key into totals
+        totals[key] = _add(totals[key], value) if key in totals else value
+
+    def expose(self):
+        return self.lines(self.collect())
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self, values):
+        return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {value}"
+                                for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), callback=None, multiprocess='sum'):
+        super().__init__(name, help, labels)
+        # Optional function returning the value (or {label tuple: value}) at scrape time
+        self.callback = callback
+        # How the values of live processes combine: 'sum', or 'max' for
+        # values every process reads from the same place
+        self.multiprocess = multiprocess
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def collect(self):
+        if self.callback is not None:
+            value = self.callback()
+            with self._lock:
+                self._values = value if isinstance(value, dict) else {(): value}
+        return super().collect()
+
+    def merge(self, totals, key, value):
+        if self.multiprocess == 'max' and key in totals:
+            totals[key] = max(totals[key], value)
+        else:
+            super().merge(totals, key, value)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [cumulative bucket counts, sum, count]
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def collect(self):
+        with self._lock:
+            return {key: [list(buckets), total, count]
+                    for key, (buckets, total, count) in self._values.items()}
+
+    def lines(self, values):
+        lines = self.header()
+        for key, (buckets, total, count) in sorted(values.items()):
+            for bound, bucket in zip(self.buckets, buckets):
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(self.labels, key, [('le', bound)])} {bucket}")
+            lines.append(f"{self.name}_bucket"
+                         f"{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write(path, data):
+    # Write to a temporary name and rename, so readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _locked(directory, exclusive):
+    # Scrapes read the files under a shared lock; moving an exited process
+    # into the archive takes it exclusively, so no scrape counts it twice or not at all
+    import fcntl
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Registry:
+    def __init__(self, directory=METRICS_DIR):
+        self._metrics = []
+        self.directory = directory
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self):
+        if self.directory is None:
+            lines = [line for metric in self._metrics for line in metric.expose()]
+        else:
+            lines = self._expose_shared()
+        return '\n'.join(lines) + '\n'
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def flush(self):
+        # Write this process's values to its file in the shared directory
+        data = {metric.name: {'type': metric.type,
+                              'values': [[list(key), value]
+                                         for key, value in metric.collect().items()]}
+                for metric in self._metrics}
+        with self._flush_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            _write(self._path(os.getpid()), data)
+
+    def _expose_shared(self):
+        # Every process's latest values, and the archive of exited ones, added up
+        self.flush()
+        metrics = {metric.name: metric for metric in self._metrics}
+        totals = {name: {} for name in metrics}
+        with _locked(self.directory, exclusive=False):
+            for filename in sorted(os.listdir(self.directory)):
+                if not filename.endswith('.json'):
+                    continue
+                for name, entry in _read(os.path.join(self.directory, filename)).items():
+                    metric = metrics.get(name)
+                    if metric is None:
+                        continue
+                    for key, value in entry['values']:
+                        metric.merge(totals[name], tuple(key), value)
+        return [line for metric in self._metrics for line in metric.lines(totals[metric.name])]
+
+    def retire(self, pid):
+        # Once a process has exited, its counters and histograms move to the
+        # archive so totals never go down; its gauges are dropped
+        if self.directory is None:
+            return
+        path = self._path(pid)
+        archive_path = os.path.join(self.directory, ARCHIVE_NAME)
+        with _locked(self.directory, exclusive=True):
+            data = _read(path)
+            if data:
+                archive = _read(archive_path)
+                for name, entry in data.items():
+                    if entry['type'] == 'gauge':
+                        continue
+                    archived = archive.setdefault(name, {'type': entry['type'], 'values': []})
+                    values = {tuple(key): value for key, value in archived['values']}
+                    for key, value in entry['values']:
+                        key = tuple(key)
+                        values[key] = _add(values[key], value) if key in values else value
+                    archived['values'] = [[list(key), value] for key, value in values.items()]
+                _write(archive_path, archive)
+            # ... and the file it may have been writing when it exited
+            for leftover in (path, f"{path}.{pid}.tmp"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def clear(self):
+        # Start over, e.g. when the server starts: drop every process's file
+        if self.directory is None:
+            return
+        with _locked(self.directory, exclusive=True):
+            for filename in os.listdir(self.directory):
+                if filename.endswith(('.json', '.tmp')):
+                    os.remove(os.path.join(self.directory, filename))
+
+    def start(self, interval=METRICS_FLUSH_INTERVAL):
+        # Keep this process's file current for scrapes answered by the others
+        if self.directory is None or self._flusher is not None:
+            return
+        self._flusher = threading.Thread(target=self._flush_periodically, args=(interval,),
+                                         name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_periodically(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing metrics failed")
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'chart_stage_seconds', 'Time spent per request stage', ['stage']))
+REQUEST_SECONDS = registry.register(Histogram(
+    'chart_request_seconds', 'Request latency per endpoint', ['endpoint']))
+REQUESTS = registry.register(Counter(
+    'chart_requests_total', 'Requests per endpoint and status', ['endpoint', 'status']))
+RESPONSE_BYTES = registry.register(Counter(
+    'chart_response_bytes_total', 'Response body bytes per endpoint', ['endpoint']))
+IN_FLIGHT = registry.register(Gauge(
+    'chart_requests_in_flight', 'Requests currently being handled'))
+CACHE_LOOKUPS = registry.register(Counter(
+    'chart_cache_lookups_total', 'Render cache lookups by the tier that answered', ['result']))
+LIVE_FIGURES = registry.register(Gauge(
+    'chart_live_figures', 'Matplotlib figures alive per render process', ['pid']))
+RENDERS_COALESCED = registry.register(Counter(
+    'chart_renders_coalesced_total', 'Requests served by an identical render already in flight'))
+RENDER_RSS = registry.register(Gauge(
+    'chart_render_rss_bytes', 'Resident memory per render process', ['pid']))
+RENDER_RECYCLES = registry.register(Counter(
+    'chart_render_recycles_total', 'Render pools replaced by fresh processes', ['reason']))
+
+
+def rss_bytes():
+    # Resident memory of this process now, or its peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Stage durations of the current request, when one is being collected
+_timings = contextvars.ContextVar('chart_timings', default=None)
+
+
+def add_stage(name, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+    else:
+        # Outside a request (background writes, warm-up) record it directly
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+
+def add_stages(timings):
+    for name, seconds in timings.items():
+        add_stage(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def collect():
+    # Gather stage timings in this context instead of recording them, e.g. in a
+    # render worker that sends them back with the result
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def begin_request():
+    IN_FLIGHT.inc()
+    return _timings.set({}), time.perf_counter()
+
+
+def end_request(state, endpoint, status, size=None):
+    token, start = state
+    timings = _timings.get() or {}
+    _timings.reset(token)
+    IN_FLIGHT.dec()
+
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=status)
+    if size:
+        RESPONSE_BYTES.inc(size, endpoint=endpoint)
+    for name, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=name)
+    return timings
+
+
+def server_timing(timings):
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
@@ -0,0 +1,60 @@
+import os
+import threading
+
+# Readiness shared by the web workers of one server (gunicorn.conf.py sets it):
+# every worker keeps a marker here until its render workers have warmed up, so
+# /readyz answers for the whole server rather than whichever worker the probe
+# reached. Unset, readiness is this process's alone.
+READY_DIR = os.environ.get('READY_DIR') or None
+
+MARKER_SUFFIX = '.warming'
+
+
+def _marker(pid):
+    return os.path.join(READY_DIR, f'{pid}{MARKER_SUFFIX}')
+
+
+def warming():
+    # Called in a web worker as soon as it is forked
+    if READY_DIR is None:
+        return
+    os.makedirs(READY_DIR, exist_ok=True)
+    open(_marker(os.getpid()), 'wb').close()
+
+
+def warmed(pid=None):
+    # ... once it has warmed up, and by the master when it exits
+    if READY_DIR is None:
+        return
+    try:
+        os.remove(_marker(pid or os.getpid()))
+    except FileNotFoundError:
+        pass
+
+
+def warmed_when_set(event):
+    # Drop this worker's marker once event (its render pool's) is set
+    def wait():
+        event.wait()
+        warmed()
+
+    threading.Thread(target=wait, name='readiness', daemon=True).start()
+
+
+def all_warm():
+    if READY_DIR is None:
+        return True
+    try:
+        return not any(name.endswith(MARKER_SUFFIX) for name in os.listdir(READY_DIR))
+    except FileNotFoundError:
+        return True
+
+
+def clear():
+    # Markers left by an earlier server in the same directory
+    if READY_DIR is None:
+        return
+    os.makedirs(READY_DIR, exist_ok=True)
+    for name in os.listdir(READY_DIR):
+        if name.endswith(MARKER_SUFFIX):
+            os.remove(os.path.join(READY_DIR, name))
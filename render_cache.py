@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from chart_writer import atomic_write
+from encoding import EXTENSIONS
+
+# Byte budget for the in-memory tier; the disk tier lives under CHARTS_DIR
+CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Part of every cache key. Bump it whenever the drawing code changes what a
+# chart looks like, so files rendered by earlier deploys are not served again.
+RENDER_VERSION = 3
+
+
+def cache_key(kind, payload, fmt='png', options=None):
+    # Canonical JSON of the normalized request, so key order and whitespace
+    # in the client payload do not change the hash
+    request = {'version': RENDER_VERSION, 'kind': kind, 'format': fmt, 'payload': payload}
+    if options:
+        request['options'] = options
+    canonical = json.dumps(request,
+                           sort_keys=True, separators=(',', ':'),
+                           ensure_ascii=False, default=_tolist)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _tolist(value):
+    # NumPy score arrays hash like the lists of floats they were made from
+    tolist = getattr(value, 'tolist', None)
+    if tolist is None:
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+    return tolist()
+
+
+class RenderCache:
+    def __init__(self, storage, max_bytes=CACHE_MAX_BYTES, writer=None, flights=None):
+        # ChartStorage that decides where chart files live and tracks them
+        self.storage = storage
+        self.max_bytes = max_bytes
+        # Optional ChartWriter; without one files are written synchronously
+        self.writer = writer
+        # Optional SingleFlight; with one, concurrent misses for the same chart
+        # share a single render
+        self.flights = flights
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def relpath(self, key, fmt='png'):
+        return self.storage.relpath(f"{key}.{EXTENSIONS.get(fmt, fmt)}")
+
+    def path(self, key, fmt='png'):
+        return self.storage.path(self.relpath(key, fmt))
+
+    def get(self, key, fmt='png'):
+        with metrics.stage('cache'):
+            data, result = self._lookup(key, fmt)
+        metrics.CACHE_LOOKUPS.inc(result=result)
+        return data
+
+    def _lookup(self, key, fmt):
+        # Memory tier first, then fall back to the file on disk
+        with self._lock:
+            data = self._entries.get((key, fmt))
+            if data is not None:
+                self._entries.move_to_end((key, fmt))
+        if data is not None:
+            # The file on disk is in use too, as far as quota eviction goes
+            self.storage.touch(self.relpath(key, fmt))
+            return data, 'memory'
+
+        path = self.path(key, fmt)
+        data = self.writer.pending(path) if self.writer is not None else None
+        if data is not None:
+            return data, 'pending'
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, 'miss'
+
+        self.storage.touch(self.relpath(key, fmt))
+        self._remember(key, fmt, data)
+        return data, 'disk'
+
+    def put(self, key, fmt, data):
+        self._remember(key, fmt, data)
+        self._write(key, fmt, data)
+
+    def exists(self, key, fmt='png'):
+        # True once the chart is on disk or queued to be written
+        path = self.path(key, fmt)
+        if self.writer is not None and self.writer.pending(path) is not None:
+            return True
+        return os.path.exists(path)
+
+    def ready(self, key, fmt='png'):
+        return os.path.exists(self.path(key, fmt))
+
+    def get_or_render(self, key, fmt, render):
+        data = self.get(key, fmt)
+        if data is not None:
+            return data
+        if self.flights is None:
+            return self._render(key, fmt, render)
+        # Concurrent misses wait for one render; a flight that finished since
+        # the lookup above has already stored its chart
+        return self.flights.do((key, fmt), lambda: self._lookup(key, fmt)[0]
+                               or self._render(key, fmt, render))
+
+    def _render(self, key, fmt, render):
+        data = render()
+        self.put(key, fmt, data)
+        return data
+
+    def save(self, key, fmt, render):
+        # Make sure the chart file exists; the memory tier may still hold a
+        # chart whose file the storage reaper already deleted
+        if not self.exists(key, fmt):
+            self.put(key, fmt, self.get_or_render(key, fmt, render))
+
+    def _remember(self, key, fmt, data):
+        # Entries bigger than the whole budget only go to disk
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop((key, fmt), None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[(key, fmt)] = data
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _write(self, key, fmt, data):
+        path = self.path(key, fmt)
+        if os.path.exists(path):
+            return
+
+        relpath = self.relpath(key, fmt)
+        if self.writer is not None:
+            self.writer.write(path, data,
+                              on_done=lambda: self.storage.add(relpath, len(data)))
+        else:
+            with metrics.stage('write'):
+                atomic_write(path, data)
+            self.storage.add(relpath, len(data))
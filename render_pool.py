@@ -0,0 +1,296 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+# Number of render processes; 0 renders inline on the request thread
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+# Jobs allowed to wait for a free worker before requests are rejected
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', 32))
+# Seconds a request waits for its render
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 30))
+# Retry-After value sent with 503 responses
+RENDER_RETRY_AFTER = int(os.environ.get('RENDER_RETRY_AFTER', 1))
+# Render processes are replaced after this many renders each (0 never), which
+# hands back the memory matplotlib and the allocator hold on to
+RENDER_RECYCLE_JOBS = int(os.environ.get('RENDER_RECYCLE_JOBS', 1000))
+# ... or as soon as one of them grows past this many MiB (0 no limit)
+RENDER_MAX_RSS_MB = int(os.environ.get('RENDER_MAX_RSS_MB', 512))
+# Longest pause, in seconds, between retries of a failed warm-up
+RENDER_WARM_UP_MAX_DELAY = float(os.environ.get('RENDER_WARM_UP_MAX_DELAY', 60))
+
+logger = logging.getLogger(__name__)
+
+
+class RenderError(Exception):
+    status = 500
+    retry_after = None
+
+
+class RenderQueueFull(RenderError):
+    status = 503
+    retry_after = RENDER_RETRY_AFTER
+
+
+class RenderTimeout(RenderError):
+    status = 504
+
+
+def _init_worker(warmed):
+    # Each worker owns its Agg canvases, fonts and figure templates, and
+    # reports its pid once they are ready. A worker whose warm-up fails still
+    # renders, just slower the first time, so it reports all the same.
+    import chart_render
+    try:
+        chart_render.warm_up()
+    except Exception:
+        logger.exception("Render worker warm-up failed")
+    warmed.put(os.getpid())
+
+
+def _render(kind, payload, fmt, options=None):
+    # Stage timings, the live figure count and memory travel back with the image
+    import chart_render
+    import figure_pool
+
+    with metrics.collect() as timings, figure_pool.pool.guard():
+        data = chart_render.render(kind, payload, fmt, options)
+    return data, {'stages': timings, 'pid': os.getpid(),
+                  'figures': figure_pool.live_figures(), 'rss': metrics.rss_bytes()}
+
+
+def _unpack(result, started):
+    data, stats = result
+    metrics.add_stages(stats['stages'])
+    # Whatever the worker did not spend rendering was spent queued or in transit
+    waited = time.perf_counter() - started - sum(stats['stages'].values())
+    metrics.add_stage('queue', max(waited, 0.0))
+    metrics.LIVE_FIGURES.set(stats['figures'], pid=stats['pid'])
+    metrics.RENDER_RSS.set(stats['rss'], pid=stats['pid'])
+    return data
+
+
+class RenderPool:
+    def __init__(self, workers=RENDER_WORKERS, queue_size=RENDER_QUEUE_SIZE,
+                 timeout=RENDER_TIMEOUT, recycle_jobs=RENDER_RECYCLE_JOBS,
+                 max_rss=RENDER_MAX_RSS_MB * 1024 * 1024):
+        self.workers = workers
+        self.timeout = timeout
+        self.recycle_jobs = recycle_jobs
+        self.max_rss = max_rss
+        # One slot per running or queued job; released when the job finishes
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        # Jobs queued or running, for the metrics endpoint
+        self.jobs = 0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Set once every worker has warmed up, or a render has succeeded, for
+        # the readiness probe
+        self.warmed = threading.Event()
+        self._closed = False
+
+    def _get_executor(self):
+        # Created lazily, and again after a fork, so each process owns its pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context('spawn')
+                warmed = context.Queue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context,
+                    initializer=_init_worker, initargs=(warmed,))
+                self._executor.warmed = warmed
+                # Workers that reported in on warmed
+                self._executor.ready = 0
+                # Renders finished and processes seen, for recycling
+                self._executor.completed = 0
+                self._executor.pids = set()
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _finished(self, executor, future):
+        self._released()
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.warmed.set()
+        stats = future.result()[1]
+        with self._lock:
+            executor.completed += 1
+            executor.pids.add(stats['pid'])
+            completed = executor.completed
+        if self.max_rss and stats['rss'] > self.max_rss:
+            self._recycle(executor, 'memory')
+        elif self.recycle_jobs and completed >= self.recycle_jobs * self.workers:
+            self._recycle(executor, 'jobs')
+
+    def _recycle(self, executor, reason):
+        # New jobs go to a fresh pool; the old one finishes the jobs it already
+        # has, queued ones included, and then its processes exit
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        logger.info("Recycling render processes after %d renders (%s)",
+                    executor.completed, reason)
+        metrics.RENDER_RECYCLES.inc(reason=reason)
+        threading.Thread(target=self._retire, args=(executor,), name='render-recycle',
+                         daemon=True).start()
+        # Spawn and warm up the replacements before requests need them
+        self.start()
+
+    def _retire(self, executor):
+        executor.shutdown(wait=True)
+        for pid in executor.pids:
+            metrics.LIVE_FIGURES.remove(pid=pid)
+            metrics.RENDER_RSS.remove(pid=pid)
+
+    def start(self):
+        # Start the workers and warm them up without holding up the server
+        threading.Thread(target=self._warm_up, name='render-warm-up', daemon=True).start()
+
+    def _warm_up(self):
+        # Retried with backoff until it succeeds or the pool is shut down
+        delay = 1.0
+        while not self._closed:
+            try:
+                self._warm_up_workers()
+            except Exception:
+                logger.exception("Render warm-up failed, retrying in %.0fs", delay)
+            else:
+                self.warmed.set()
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, RENDER_WARM_UP_MAX_DELAY)
+
+    def _warm_up_workers(self):
+        if self.workers <= 0:
+            # Inline renders share this process's fonts and encoders
+            import chart_render
+            chart_render.warm_up()
+            return
+
+        executor = self._get_executor()
+        try:
+            # Every job submitted while no worker is idle starts another one
+            for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result(timeout=self.timeout)
+            while executor.ready < self.workers:
+                executor.warmed.get(timeout=self.timeout)
+                executor.ready += 1
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def submit(self, kind, payload, fmt='png', options=None, wait=None):
+        # wait=None rejects immediately when full, otherwise blocks up to wait seconds
+        if not self._slots.acquire(blocking=wait is not None, timeout=wait):
+            raise RenderQueueFull("Render queue is full, try again later")
+        self._acquired()
+
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(_render, kind, payload, fmt, options)
+            except (BrokenProcessPool, RuntimeError) as e:
+                # A worker died, or the pool was recycled while the job was
+                # handed in; retry once on a fresh pool
+                if isinstance(e, BrokenProcessPool):
+                    self._reset(executor)
+                executor = self._get_executor()
+                future = executor.submit(_render, kind, payload, fmt, options)
+        except Exception:
+            self._released()
+            raise
+
+        future.started = time.perf_counter()
+        future.add_done_callback(lambda done: self._finished(executor, done))
+        return future
+
+    def _acquired(self):
+        with self._lock:
+            self.jobs += 1
+
+    def _released(self):
+        with self._lock:
+            self.jobs -= 1
+        self._slots.release()
+
+    def _result(self, future, timeout=None):
+        try:
+            return _unpack(future.result(timeout=timeout or self.timeout),
+                           future.started)
+        except TimeoutError:
+            # A job already running keeps its slot until the worker finishes it
+            future.cancel()
+            raise RenderTimeout("Rendering the chart timed out")
+
+    def render(self, kind, payload, fmt='png', options=None, timeout=None):
+        if self.workers <= 0:
+            return self._render_inline(kind, payload, fmt, options)
+
+        return self._result(self.submit(kind, payload, fmt, options), timeout)
+
+    def map(self, jobs, timeout=None):
+        # Render (kind, payload, fmt, options) jobs in parallel and yield (data, error)
+        # in order. Only a couple of jobs per worker are in flight at once, so a
+        # large batch waits for free slots instead of flooding the queue.
+        if self.workers <= 0:
+            for kind, payload, fmt, options in jobs:
+                yield _outcome(lambda: self._render_inline(kind, payload, fmt, options))
+            return
+
+        window = deque()
+        for kind, payload, fmt, options in jobs:
+            if len(window) >= self.workers * 2:
+                future = window.popleft()
+                yield _outcome(lambda: self._result(future, timeout))
+            try:
+                future = self.submit(kind, payload, fmt, options,
+                                     wait=timeout or self.timeout)
+            except RenderError as e:
+                future = Future()
+                future.set_exception(e)
+            window.append(future)
+
+        while window:
+            future = window.popleft()
+            yield _outcome(lambda: self._result(future, timeout))
+
+    def _render_inline(self, kind, payload, fmt, options=None):
+        # Renders on the request thread; the slots still bound concurrency
+        if not self._slots.acquire(blocking=False):
+            raise RenderQueueFull("Render queue is full, try again later")
+        self._acquired()
+        started = time.perf_counter()
+        try:
+            data = _unpack(_render(kind, payload, fmt, options), started)
+            self.warmed.set()
+            return data
+        finally:
+            self._released()
+
+
+def _outcome(get):
+    try:
+        return get(), None
+    except Exception as e:
+        return None, e
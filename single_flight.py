@@ -0,0 +1,49 @@
+import os
+import threading
+from concurrent.futures import Future, TimeoutError
+
+import metrics
+from render_pool import RENDER_TIMEOUT, RenderTimeout
+
+# Seconds a request waits for an identical render already in flight
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', RENDER_TIMEOUT))
+
+
+class SingleFlight:
+    # Runs one call per key at a time. Callers arriving while it runs wait for
+    # its result (or exception) instead of repeating the work.
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            metrics.RENDERS_COALESCED.inc()
+            try:
+                with metrics.stage('coalesce'):
+                    return call.result(timeout=self.timeout)
+            except TimeoutError:
+                raise RenderTimeout("Timed out waiting for an identical render")
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
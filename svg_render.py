@@ -0,0 +1,246 @@
+import math
+import os
+from functools import lru_cache
+
+import chart_spec
+
+try:
+    import cairosvg
+except ImportError:  # PNG rasterization is optional
+    cairosvg = None
+
+# Rasterize the SVG Ikigai to PNG with cairosvg instead of matplotlib
+IKIGAI_SVG_RASTER = os.environ.get('IKIGAI_SVG_RASTER', '0') == '1'
+# Distinct text lines whose outlines are kept
+TEXT_PATH_CACHE_SIZE = int(os.environ.get('TEXT_PATH_CACHE_SIZE', 4096))
+
+# Text is drawn as glyph outlines in the chart font, so the SVG looks the same
+# wherever it is opened or printed
+FONT_FAMILY = 'DejaVu Sans'
+
+# Same geometry as the matplotlib Ikigai: a 10x10 inch figure at 100 dpi
+# showing data coordinates -2.5..2.5 on both axes
+SIZE = 1000
+SCALE = SIZE / 5.0
+
+# The wheel is laid out like the 6x6 inch matplotlib figure
+WHEEL_SIZE = 600
+_WHEEL_CENTER = (300.0, 320.0)
+_WHEEL_RADIUS = 210.0
+# Distance from the rim to the category labels
+_WHEEL_LABEL_GAP = 14.0
+# Room kept between the text and the edge of the canvas. Long labels shrink
+# the wheel down to the smallest radius; past that the canvas grows instead.
+_WHEEL_MARGIN = 8.0
+_WHEEL_MIN_RADIUS = _WHEEL_RADIUS / 2
+
+# Filter that paints a white box behind the text, like backgroundcolor='white'
+_BACKGROUND_FILTER = (
+    '<defs><filter id="bg" x="-0.05" y="-0.1" width="1.1" height="1.2">'
+    '<feFlood flood-color="white"/><feComposite in="SourceGraphic" operator="over"/>'
+    '</filter></defs>')
+
+_PATH_COMMANDS = {1: 'M', 2: 'L', 3: 'Q', 4: 'C'}
+
+
+def _px(x, y):
+    # Data coordinates to SVG pixels (y grows downwards in SVG)
+    return (x + 2.5) * SCALE, (2.5 - y) * SCALE
+
+
+def _pt(size):
+    # Font sizes are in points; the figures are rendered at 100 dpi
+    return size * 100 / 72.0
+
+
+@lru_cache(maxsize=None)
+def _font(weight):
+    # matplotlib is only needed for the glyph outlines, and only the first time
+    # a line of text is drawn
+    from matplotlib import font_manager
+
+    prop = font_manager.FontProperties(family=FONT_FAMILY, weight=weight)
+    font = font_manager.get_font(font_manager.findfont(prop))
+    # Middle of the line box above the baseline, per pixel of font size
+    middle = (font.ascender + font.descender) / 2.0 / font.units_per_EM
+    return prop, middle
+
+
+@lru_cache(maxsize=TEXT_PATH_CACHE_SIZE)
+def text_path(line, size, weight='bold'):
+    # SVG path data of one line of text, size pixels high, centered on the
+    # origin, and its width. Category names and labels repeat across requests,
+    # so their outlines are only laid out once.
+    if not line.strip():
+        return '', 0.0
+    from matplotlib.textpath import TextPath
+
+    prop, middle = _font(weight)
+    path = TextPath((0, 0), line, size=size, prop=prop)
+    extents = path.get_extents()
+    dx = -(extents.x0 + extents.x1) / 2.0
+    dy = middle * size
+
+    parts = []
+    for vertices, code in path.iter_segments(simplify=False, curves=True):
+        if code == 79:  # CLOSEPOLY
+            parts.append('Z')
+        elif code in _PATH_COMMANDS:
+            points = vertices.reshape(-1, 2)
+            parts.append(_PATH_COMMANDS[code] + ' '.join(
+                f'{x + dx:.2f} {dy - y:.2f}' for x, y in points))
+    return ''.join(parts), extents.width
+
+
+def _text(value, x, y, size, color='#000000', background=False, align=0.0):
+    # Multi-line text is centered on the anchor as a block, like matplotlib.
+    # align shifts each line by that many widths: 0.5 starts it at the anchor,
+    # -0.5 ends it there.
+    lines = value.split('\n')
+    first = -(len(lines) - 1) * 0.6 * size
+    paths = ''.join(
+        f'<path transform="translate({x + align * width:.1f} {y + first + i * 1.2 * size:.1f})"'
+        f' d="{d}"/>'
+        for i, (d, width) in enumerate(text_path(line, round(size, 2)) for line in lines) if d)
+    extra = ' filter="url(#bg)"' if background and paths else ''
+    return f'<g fill="{color}"{extra}>{paths}</g>'
+
+
+def _build_ikigai_template():
+    # Everything but the nine text groups is computed once at import time
+    layout = chart_spec.IKIGAI_LAYOUT
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{SIZE}" height="{SIZE}" '
+        f'viewBox="0 0 {SIZE} {SIZE}">',
+        _BACKGROUND_FILTER,
+        f'<rect width="{SIZE}" height="{SIZE}" fill="white"/>',
+    ]
+    for center, color in zip(layout.centers, layout.colors):
+        cx, cy = _px(*center)
+        parts.append(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{layout.radius * SCALE:.1f}" '
+                     f'fill="{color}" fill-opacity="0.4"/>')
+    for i in range(4):
+        parts.append(f'{{label{i}}}')
+    for i in range(4):
+        parts.append(f'{{overlap{i}}}')
+    parts.append('{title}</svg>')
+    return '\n'.join(parts)
+
+
+IKIGAI_TEMPLATE = _build_ikigai_template()
+
+
+def _ikigai_text(spec):
+    layout = spec.layout
+    values = {'title': _text(spec.title, *_px(0, 0), _pt(20), '#555555', background=True)}
+    for i, (label, position) in enumerate(zip(spec.labels, layout.label_positions)):
+        values[f'label{i}'] = _text(label, *_px(*position), _pt(9))
+    for i, (label, position) in enumerate(zip(spec.overlaps, layout.overlap_positions)):
+        values[f'overlap{i}'] = _text(label, *_px(*position), _pt(9), background=True)
+    return values
+
+
+def ikigai_svg(spec):
+    # The Ikigai only has text to fill in, laid out once per text key
+    values = chart_spec.layouts.get(('svg', spec.text_key), lambda: _ikigai_text(spec))
+    return IKIGAI_TEMPLATE.format(**values).encode('utf-8')
+
+
+def _text_extent(value, size, align):
+    # Left and right edges of a _text block relative to its anchor, and half
+    # its height
+    widths = [text_path(line, round(size, 2))[1] for line in value.split('\n')]
+    left = min((align - 0.5) * width for width in widths)
+    right = max((align + 0.5) * width for width in widths)
+    return left, right, len(widths) * 0.6 * size
+
+
+def _reach(room, direction):
+    # Largest radius whose label, moving along direction, stays within room
+    if direction <= 1e-9:
+        return math.inf
+    return room / direction - _WHEEL_LABEL_GAP
+
+
+def _wheel_text(spec):
+    # Category labels grow away from the wheel: rightwards on its right side,
+    # leftwards on its left, centered at the top and bottom. The radius is
+    # chosen so every label and the title fit on the canvas; returns the
+    # opening of the document, the radius and the text.
+    cx, cy = _WHEEL_CENTER
+    size = _pt(10)
+    title_left, title_right, title_half = _text_extent(spec.title, _pt(14), 0.0)
+    top = 30.0 + title_half + _WHEEL_MARGIN
+    left, right, bottom = _WHEEL_MARGIN, WHEEL_SIZE - _WHEEL_MARGIN, WHEEL_SIZE - _WHEEL_MARGIN
+
+    labels = []
+    radius = min(_WHEEL_RADIUS, cx - left, right - cx, cy - top, bottom - cy)
+    for theta, area in zip(spec.layout.theta, spec.categories):
+        # Direction of the label in SVG coordinates (y grows downwards)
+        cos, sin = math.cos(theta), -math.sin(theta)
+        align = 0.0 if abs(cos) < 0.2 else math.copysign(0.5, cos)
+        low, high, half = _text_extent(area, size, align)
+        labels.append((area, cos, sin, align, low, high, half))
+        radius = min(radius, _reach(cx + low - left, -cos), _reach(right - cx - high, cos),
+                     _reach(cy - half - top, -sin), _reach(bottom - cy - half, sin))
+    radius = max(radius, _WHEEL_MIN_RADIUS)
+
+    # Grow the canvas around whatever still sticks out
+    x0, y0, x1, y1 = 0.0, 0.0, float(WHEEL_SIZE), float(WHEEL_SIZE)
+    parts = []
+    for area, cos, sin, align, low, high, half in labels:
+        x = cx + (radius + _WHEEL_LABEL_GAP) * cos
+        y = cy + (radius + _WHEEL_LABEL_GAP) * sin
+        x0, x1 = min(x0, x + low - _WHEEL_MARGIN), max(x1, x + high + _WHEEL_MARGIN)
+        y0, y1 = min(y0, y - half - _WHEEL_MARGIN), max(y1, y + half + _WHEEL_MARGIN)
+        parts.append(_text(area, x, y, size, '#555555', align=align))
+    parts.append(_text(spec.title, WHEEL_SIZE / 2, 30.0, _pt(14)))
+    x0 = min(x0, WHEEL_SIZE / 2 + title_left - _WHEEL_MARGIN)
+    x1 = max(x1, WHEEL_SIZE / 2 + title_right + _WHEEL_MARGIN)
+
+    x0, y0 = math.floor(x0), math.floor(y0)
+    width, height = math.ceil(x1) - x0, math.ceil(y1) - y0
+    header = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+              f'height="{height}" viewBox="{x0} {y0} {width} {height}">\n'
+              f'<rect x="{x0}" y="{y0}" width="{width}" height="{height}" fill="white"/>')
+    return header, radius, '\n'.join(parts)
+
+
+def wheel_svg(spec):
+    layout = spec.layout
+    cx, cy = _WHEEL_CENTER
+    half_width = layout.width / 2
+    header, wheel_radius, text = chart_spec.layouts.get(('svg', spec.text_key),
+                                                        lambda: _wheel_text(spec))
+    parts = [header]
+    for theta, value, (color, alpha) in zip(layout.theta, spec.values, layout.colors):
+        radius = max(value, 0.0) / spec.top * wheel_radius
+        x0 = cx + radius * math.cos(theta - half_width)
+        y0 = cy - radius * math.sin(theta - half_width)
+        x1 = cx + radius * math.cos(theta + half_width)
+        y1 = cy - radius * math.sin(theta + half_width)
+        opacity = f' fill-opacity="{alpha}"' if alpha < 1 else ''
+        parts.append(f'<path d="M{cx:.1f} {cy:.1f}L{x0:.2f} {y0:.2f}'
+                     f'A{radius:.2f} {radius:.2f} 0 0 0 {x1:.2f} {y1:.2f}Z" '
+                     f'fill="{color}"{opacity} stroke="gray" stroke-width="0.5"/>')
+    parts.append(text)
+    parts.append('</svg>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+# Chart type -> SVG drawing of its compiled spec
+RENDERERS = {
+    'wheel': wheel_svg,
+    'ikigai': ikigai_svg,
+}
+
+
+def render(kind, payload, fmt='png'):
+    # Returns None when the chart has to go through matplotlib instead
+    if kind not in RENDERERS:
+        return None
+    if fmt == 'svg':
+        return RENDERERS[kind](chart_spec.compile_chart(kind, payload))
+    if fmt == 'png' and kind == 'ikigai' and IKIGAI_SVG_RASTER and cairosvg is not None:
+        return cairosvg.svg2png(bytestring=ikigai_svg(chart_spec.compile_chart(kind, payload)))
+    return None
@@ -0,0 +1,253 @@
+import json
+import os
+
+import numpy as np
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import chart_spec
+import encoding
+
+try:
+    import orjson
+except ImportError:  # the standard library parser is the fallback
+    orjson = None
+
+# Limits checked before anything is rendered
+MAX_CATEGORIES = int(os.environ.get('MAX_CATEGORIES', 32))
+MAX_LABEL_LENGTH = int(os.environ.get('MAX_LABEL_LENGTH', 100))
+MULTI_MAX_ENTITIES = int(os.environ.get('MULTI_MAX_ENTITIES', 100))
+# Pixels of one raster small-multiples chart at the requested dpi
+MULTI_MAX_PIXELS = int(os.environ.get('MULTI_MAX_PIXELS', 4096 * 4096))
+# Frames of one time-series chart, interpolated ones included
+TIMELINE_MAX_FRAMES = int(os.environ.get('TIMELINE_MAX_FRAMES', 120))
+# Pixels of all frames of one time-series chart together, which are held in
+# memory until the animation is encoded; 120 frames at 100 dpi by default
+TIMELINE_MAX_PIXELS = int(os.environ.get('TIMELINE_MAX_PIXELS', 120 * 600 * 600))
+# Side of the square time-series figure, in inches
+TIMELINE_INCHES = 6
+
+MULTI_LAYOUTS = ('grid', 'overlay')
+
+# Bytes read from the request body at a time
+READ_CHUNK = 64 * 1024
+
+
+class ValidationError(ValueError):
+    status = 400
+
+
+class PayloadTooLarge(ValidationError):
+    status = 413
+
+
+def read_body(stream, max_bytes):
+    # Read the body in chunks and stop as soon as it passes max_bytes, so
+    # chunked uploads without a Content-Length are cut off as well
+    chunks = []
+    size = 0
+    try:
+        while True:
+            chunk = stream.read(READ_CHUNK)
+            if not chunk:
+                return b''.join(chunks)
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise PayloadTooLarge("Request body too large")
+            chunks.append(chunk)
+    except RequestEntityTooLarge:
+        # Newer Werkzeug enforces MAX_CONTENT_LENGTH on the stream itself
+        raise PayloadTooLarge("Request body too large")
+
+
+def read_json(request, max_bytes):
+    body = read_body(request.stream, max_bytes)
+    try:
+        data = orjson.loads(body) if orjson is not None else json.loads(body)
+    except ValueError:
+        raise ValidationError("Request body must be valid JSON")
+    if not isinstance(data, dict):
+        raise ValidationError("Invalid data format")
+    return data
+
+
+def _strings(data, name, max_items=MAX_CATEGORIES):
+    values = data[name]
+    if not isinstance(values, list):
+        raise ValidationError(f"'{name}' must be a list")
+    if len(values) > max_items:
+        raise ValidationError(f"'{name}' can have at most {max_items} items")
+    return [_string(value, name) for value in values]
+
+
+def _string(value, name):
+    value = str(value)
+    if len(value) > MAX_LABEL_LENGTH:
+        raise ValidationError(f"'{name}' entries can be at most {MAX_LABEL_LENGTH} characters")
+    return value
+
+
+def _scores(values, ndim):
+    # One float64 array for the whole matrix; float64 keeps the cache keys
+    # of existing charts
+    try:
+        scores = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValidationError("'data' must contain numbers")
+    if scores.ndim != ndim:
+        raise ValidationError("'data' must be a list of numbers" if ndim == 1
+                              else "'data' must be a list of rows of numbers")
+    if not np.isfinite(scores).all():
+        raise ValidationError("'data' must contain finite numbers")
+    return scores
+
+
+def wheel_payload(data):
+    # Normalize the request so equivalent payloads share a cache key
+    categories = _strings(data, 'categories')
+    if not isinstance(data['data'], list) or len(data['data']) != len(categories):
+        raise ValidationError("'data' and 'categories' must have the same length")
+    return {
+        'data': _scores(data['data'], 1),
+        'categories': categories,
+        'title': _string(data['title'], 'title'),
+    }
+
+
+def multi_payload(data):
+    # Scores are a matrix with one row per entity and one column per category
+    layout = data.get('layout', 'grid')
+    if layout not in MULTI_LAYOUTS:
+        raise ValidationError(f"'layout' must be one of: {', '.join(MULTI_LAYOUTS)}")
+    entities = _strings(data, 'entities', MULTI_MAX_ENTITIES)
+    categories = _strings(data, 'categories')
+    if not entities:
+        raise ValidationError("'entities' must not be empty")
+    if not categories:
+        raise ValidationError("'categories' must not be empty")
+    if not isinstance(data['data'], list) or len(data['data']) != len(entities):
+        raise ValidationError("'data' must have one row per entity and one score per category")
+    scores = _scores(data['data'], 2)
+    if scores.shape[1] != len(categories):
+        raise ValidationError("'data' must have one row per entity and one score per category")
+    return {
+        'data': scores,
+        'entities': entities,
+        'categories': categories,
+        'title': _string(data['title'], 'title'),
+        'layout': layout,
+    }
+
+
+def _int(data, name, default, low, high):
+    try:
+        value = int(data.get(name, default))
+    except (TypeError, ValueError):
+        raise ValidationError(f"'{name}' must be an integer")
+    if not low <= value <= high:
+        raise ValidationError(f"'{name}' must be between {low} and {high}")
+    return value
+
+
+def _frame_count(snapshots, steps):
+    return (snapshots - 1) * (steps + 1) + 1
+
+
+def timeline_payload(data):
+    # Scores are a matrix with one row per snapshot, oldest first
+    categories = _strings(data, 'categories')
+    if not categories:
+        raise ValidationError("'categories' must not be empty")
+    if not isinstance(data['data'], list) or not data['data']:
+        raise ValidationError("'data' must have one row of scores per snapshot")
+    scores = _scores(data['data'], 2)
+    if scores.shape[1] != len(categories):
+        raise ValidationError("'data' must have one score per category in every row")
+    snapshots = len(scores)
+    labels = _strings(data, 'labels', snapshots) if 'labels' in data else [''] * snapshots
+    if len(labels) != snapshots:
+        raise ValidationError("'labels' must have one label per snapshot")
+    steps = _int(data, 'steps', 0, 0, TIMELINE_MAX_FRAMES)
+    if _frame_count(snapshots, steps) > TIMELINE_MAX_FRAMES:
+        raise ValidationError(f"A time series can have at most {TIMELINE_MAX_FRAMES} frames")
+    return {
+        'data': scores,
+        'categories': categories,
+        'title': _string(data['title'], 'title'),
+        'labels': labels,
+        'steps': steps,
+        'duration': _int(data, 'duration', 1000, 20, 60000),
+    }
+
+
+def ikigai_payload(data):
+    return {
+        'labels': _strings(data, 'labels'),
+        'overlap': _strings(data, 'overlap'),
+        'title': _string(data['title'], 'title'),
+    }
+
+
+# Chart type -> required request keys and payload normalizer
+CHART_TYPES = {
+    'wheel': (('data', 'categories', 'title'), wheel_payload),
+    'multi': (('data', 'entities', 'categories', 'title'), multi_payload),
+    'timeline': (('data', 'categories', 'title'), timeline_payload),
+    'ikigai': (('labels', 'overlap', 'title'), ikigai_payload),
+}
+
+# Chart types rendered as animations, with their own formats; batches are
+# single images only
+ANIMATED_TYPES = ('timeline',)
+
+
+def chart_payload(kind, data):
+    keys, normalize = CHART_TYPES[kind]
+    if not isinstance(data, dict) or any(key not in data for key in keys):
+        raise ValidationError("Invalid data format")
+    return normalize(data)
+
+
+def parse_request(request, kind, max_bytes):
+    # The shared front half of the chart endpoints: the request body, the
+    # normalized payload, the output format and its options
+    data = read_json(request, max_bytes)
+    payload = chart_payload(kind, data)
+    try:
+        if kind in ANIMATED_TYPES:
+            fmt, options = encoding.parse_options(data, encoding.ANIMATED_FORMATS, 'gif')
+        else:
+            fmt, options = encoding.parse_options(data)
+    except ValueError as e:
+        raise ValidationError(str(e))
+    check_size(kind, payload, fmt, options)
+    return data, payload, fmt, options
+
+
+def check_size(kind, payload, fmt='png', options=None):
+    # Charts whose pixels would not fit in a render worker's memory are
+    # turned away before anything is drawn
+    options = options or {}
+    if kind in ANIMATED_TYPES:
+        check_animation_size(payload, options)
+    elif kind == 'multi' and fmt in encoding.RASTER_FORMATS:
+        check_multi_size(payload, options)
+
+
+def check_multi_size(payload, options):
+    width, height = chart_spec.multi_figure_size(payload['layout'], len(payload['entities']))
+    dpi = options.get('dpi', 100)
+    pixels = round(width * dpi) * round(height * dpi)
+    if pixels > MULTI_MAX_PIXELS:
+        raise PayloadTooLarge(
+            f"A chart can have at most {MULTI_MAX_PIXELS} pixels, this one would have "
+            f"{pixels}; use fewer entities or a lower 'dpi'")
+
+
+def check_animation_size(payload, options):
+    # Frames times their size at the requested dpi, within TIMELINE_MAX_PIXELS
+    side = TIMELINE_INCHES * options.get('dpi', 100)
+    pixels = _frame_count(len(payload['data']), payload['steps']) * side * side
+    if pixels > TIMELINE_MAX_PIXELS:
+        raise PayloadTooLarge(
+            f"An animation can have at most {TIMELINE_MAX_PIXELS} pixels over all its frames, "
+            f"this one would have {pixels}; use fewer frames or a lower 'dpi'")
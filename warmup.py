@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+
+# Build-time warm-up, run from the Dockerfile:
+#
+#   RUN python warmup.py
+#
+# Builds matplotlib's font list cache under MPLCONFIGDIR, so containers load it
+# instead of scanning the system fonts on their first render, compiles the
+# modules to bytecode and renders every chart type once. A broken font or
+# Pillow setup fails the image build instead of the first request.
+
+# Font weights the charts draw text in
+FONT_WEIGHTS = ('normal', 'bold')
+
+
+def prime_fonts():
+    from matplotlib import font_manager
+
+    paths = []
+    for weight in FONT_WEIGHTS:
+        path = font_manager.findfont(font_manager.FontProperties(weight=weight),
+                                     fallback_to_default=False)
+        # Load the face and its glyph metrics
+        font_manager.get_font(path).set_text('Wheel of Life IKIGAI 0123456789')
+        paths.append(path)
+    return paths
+
+
+def main():
+    start = time.perf_counter()
+    for path in prime_fonts():
+        print(f"font: {path}")
+
+    import compileall
+    compileall.compile_dir(os.path.dirname(os.path.abspath(__file__)), maxlevels=0, quiet=1)
+
+    import chart_render
+    chart_render.warm_up()
+    print(f"warm-up done in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())